@@ -0,0 +1,104 @@
+import argparse
+import collections
+import json
+import sys
+import time
+
+from bitboard import WHITE, format_fen, format_move, parse_fen
+from arena import UNLIMITED_DEPTH
+from parallel import WORKER_TT_SIZE_MB, create_pool, default_worker_count, search_position
+from server import json_score
+from tracing import SearchTracer
+
+# The input has one position per line in FEN notation (see bitboard.format_fen); empty lines and lines starting with "#" are skipped.
+# The output is JSONL with one line per position, in input order: the input line number, the position, the best move, the score from white's point of view,
+# the principal variation and the search depth, nodes and time. A line that is not a valid position gets an "error" instead,
+# and a position where the game is already over gets no move and the score of the result.
+DEFAULT_DEPTH = 8
+# Positions handed to the worker pool ahead of the one whose result is written next, per worker.
+# Results are written as soon as they are in order, so at most this many positions per worker are held in memory, however long the input is.
+PENDING_PER_WORKER = 4
+
+
+def read_positions(lines):
+    # Yield (line number, text, position or None, error message or None) for every position line of the input
+    for number, text in enumerate(lines, 1):
+        text = text.strip()
+        if not text or text.startswith("#"):
+            continue
+        try:
+            yield number, text, parse_fen(text), None
+        except ValueError as error:
+            yield number, text, None, str(error)
+
+
+def analyze_stream(lines, executor, workers, depth, time_ms):
+    # Analyze the positions of the input lines on the worker pool and yield their results in input order.
+    # The input is read lazily and only a bounded number of positions is in flight, so the memory use does not grow with the input.
+    pending = collections.deque()
+    for number, text, position, error in read_positions(lines):
+        if error is not None:
+            pending.append(({"line": number, "input": text, "error": error}, None, None))
+        elif position.is_game_over():
+            pending.append(({"line": number, "fen": format_fen(position), "move": None, "score": json_score(float('-inf') if position.loser() == WHITE else float('inf')),
+                             "principal_variation": [], "depth": 0, "nodes": 0}, None, None))
+        else:
+            state = (position.black_men, position.black_kings, position.white_men, position.white_kings, position.turn)
+            pending.append(({"line": number, "fen": format_fen(position)}, position, executor.submit(search_position, state, depth, time_ms)))
+        while len(pending) >= workers * PENDING_PER_WORKER:
+            yield finish(*pending.popleft())
+    while pending:
+        yield finish(*pending.popleft())
+
+
+def finish(result, position, future):
+    # Fill in the result of a position from its finished search
+    if future is None:
+        return result
+    score, best_move, line, stats = future.result()
+    result["move"] = format_move(position, best_move) if best_move is not None else None
+    result["score"] = json_score(score)
+    result["principal_variation"] = SearchTracer.format_line(position, line)
+    result["depth"] = stats["depth"]
+    result["nodes"] = stats["nodes"]
+    result["elapsed_ms"] = stats["elapsed_ms"]
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze a stream of positions in FEN notation in parallel and write the best move, score and principal variation of each as JSONL.")
+    parser.add_argument("input", nargs="?", default="-", help="file with one FEN position per line, - for standard input")
+    parser.add_argument("--output", default="-", help="JSONL file to write the results to, - for standard output")
+    parser.add_argument("--depth", type=int, help="search depth of every position (default %d, or no limit with --time-ms)" % DEFAULT_DEPTH)
+    parser.add_argument("--time-ms", type=int, help="search time of every position, in milliseconds")
+    parser.add_argument("--workers", type=int, default=default_worker_count(), help="number of positions analyzed at the same time")
+    parser.add_argument("--hash-mb", type=int, default=WORKER_TT_SIZE_MB, help="transposition table size of each worker")
+    parser.add_argument("--tablebase", help="endgame tablebase file used by the searches")
+    args = parser.parse_args(argv)
+
+    depth = args.depth or (UNLIMITED_DEPTH if args.time_ms else DEFAULT_DEPTH)
+    source = sys.stdin if args.input == "-" else open(args.input)
+    output = sys.stdout if args.output == "-" else open(args.output, "w")
+    executor = create_pool(args.workers, args.hash_mb, args.tablebase)
+    start = time.perf_counter()
+    count = errors = 0
+    try:
+        for result in analyze_stream(source, executor, args.workers, depth, args.time_ms):
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+            count += 1
+            errors += "error" in result
+    except KeyboardInterrupt:
+        pass
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+    print("%d positions (%d errors) in %.1fs" % (count, errors, time.perf_counter() - start), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
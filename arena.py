@@ -0,0 +1,256 @@
+import argparse
+import json
+import math
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from bitboard import Position, BLACK, WHITE, format_move
+from parallel import default_worker_count
+from search import Searcher, QUIESCENCE_NODE_BUDGET
+from tablebase import Tablebase
+from transposition import TranspositionTable
+
+# A game is drawn when it reaches this many plies, or when the same position comes up this many times with the same side to move
+MAX_PLIES = 200
+REPETITIONS = 3
+# Transposition table size of each engine in a game
+ARENA_TT_SIZE_MB = 16
+# Depth limit used when the engines only have a time budget
+UNLIMITED_DEPTH = 64
+# Search depth of an engine given neither a depth nor a time on the command line
+DEFAULT_DEPTH = 4
+# Largest score difference, in men, from the best move for a move to be chosen for variety
+DEFAULT_VARIETY_MARGIN = 0.1
+
+
+def engine_config(depth, time_ms, quiescence_budget, tablebase_path, variety_plies=0, variety_margin=DEFAULT_VARIETY_MARGIN):
+    # The settings of one engine, as a plain dict so that they can be sent to the worker processes and written to the results.
+    # For the first variety_plies plies of a game the engine plays a random move among those scoring at most variety_margin below its best one.
+    return {"depth": depth, "time_ms": time_ms, "quiescence_budget": quiescence_budget, "tablebase": tablebase_path,
+            "variety_plies": variety_plies, "variety_margin": variety_margin}
+
+
+def play_opening(position, plies, rng):
+    # Play random legal moves from the start position and return them in text notation.
+    # Both games of a pair start from the same opening, with the engines swapping colors, so the luck of the opening evens out.
+    opening = []
+    for _ in range(plies):
+        moves = position.get_legal_moves(position.turn)
+        if not moves or position.is_game_over():
+            break
+        move = rng.choice(moves)
+        opening.append(format_move(position, move))
+        position.apply(move)
+    return opening
+
+
+def play_game(game, engines, black_engine, opening_plies, seed, opening_index=None):
+    # Worker task: play one game between the two engines and return its record.
+    # engines maps "A" and "B" to their settings and black_engine says which of them plays black.
+    # The opening of the game, and the random choices of engines that play for variety, depend only on the seed and opening_index,
+    # which is by default the pair the game belongs to.
+    position = Position.initial()
+    opening_index = game // 2 if opening_index is None else opening_index
+    rng = random.Random(seed * 100003 + opening_index)
+    opening = play_opening(position, opening_plies, rng)
+    white_engine = "B" if black_engine == "A" else "A"
+    players = {BLACK: black_engine, WHITE: white_engine}
+    tables = {name: TranspositionTable(ARENA_TT_SIZE_MB) for name in engines}
+    tablebases = {name: Tablebase(config["tablebase"]) if config["tablebase"] else None for name, config in engines.items()}
+    seen = {}
+    moves, nodes, times, depths = [], [], [], []
+    result = reason = None
+    while result is None:
+        seen[position.hash] = seen.get(position.hash, 0) + 1
+        if position.is_game_over():
+            result = WHITE if position.loser() == BLACK else BLACK
+            reason = "no moves"
+        elif seen[position.hash] >= REPETITIONS:
+            result, reason = "draw", "repetition"
+        elif len(opening) + len(moves) >= MAX_PLIES:
+            result, reason = "draw", "move limit"
+        else:
+            name = players[position.turn]
+            config = engines[name]
+            # With a fixed depth every move, forced or not, is searched to that depth, so that the recorded depths and nodes are comparable
+            searcher = Searcher(position.copy(), tables[name], tablebase=tablebases[name], quiescence_budget=config["quiescence_budget"],
+                                search_forced_moves=config["depth"] is not None)
+            start = time.perf_counter()
+            move = searcher.search(config["depth"] or UNLIMITED_DEPTH, config["time_ms"])[1]
+            times.append(round((time.perf_counter() - start) * 1000.0, 1))
+            nodes.append(searcher.stats.nodes)
+            depths.append(searcher.stats.depth)
+            if len(opening) + len(moves) < config["variety_plies"]:
+                move = choose_varied_move(searcher, searcher.stats.depth, config["variety_margin"], rng)
+            moves.append(format_move(position, move))
+            position.apply(move)
+    for tablebase in tablebases.values():
+        if tablebase is not None:
+            tablebase.close()
+
+    if result == "draw":
+        score_a = 0.5
+    else:
+        score_a = 1.0 if players[result] == "A" else 0.0
+    return {"game": game, "black": black_engine, "white": white_engine, "opening": opening, "moves": moves,
+            "result": result, "reason": reason, "score_a": score_a, "plies": len(opening) + len(moves),
+            "nodes": nodes, "time_ms": times, "depth": depths}
+
+
+def engine_limits(depth, time_ms):
+    # The depth and time per move of one engine from its command line options (the engine's own option, else the shared one, None when neither is given).
+    # An engine without either gets DEFAULT_DEPTH; 0 means no limit, so an engine must keep a depth or a time limit.
+    # Returns (depth, time_ms) with None for no limit, or raises ValueError.
+    if depth is None and time_ms is None:
+        return DEFAULT_DEPTH, None
+    depth = depth or None
+    time_ms = time_ms or None
+    if depth is None and time_ms is None:
+        raise ValueError("needs a search depth or a time per move")
+    return depth, time_ms
+
+
+def choose_varied_move(searcher, depth, margin, rng):
+    # Pick a random move among those of the searcher's position that score at most margin below the best one at the given depth
+    scores = searcher.score_root_moves(depth)
+    best = (max if searcher.position.turn == WHITE else min)(score for score, _ in scores)
+    return rng.choice([move for score, move in scores if score == best or abs(score - best) <= margin])
+
+
+def expected_score(elo):
+    return 1.0 / (1.0 + 10.0 ** (-elo / 400.0))
+
+
+def elo_from_score(score):
+    if score <= 0.0:
+        return float('-inf')
+    if score >= 1.0:
+        return float('inf')
+    return -400.0 * math.log10(1.0 / score - 1.0)
+
+
+class MatchStats:
+    # The MatchStats class keeps the running wins, draws and losses of engine A against engine B
+    # and turns them into an Elo difference with its 95% error margin and a sequential probability ratio test (SPRT).
+    # The SPRT decides between "A is elo0 stronger than B" (H0) and "A is elo1 stronger" (H1) as soon as the games played are conclusive,
+    # using the usual normal approximation of the log-likelihood ratio on the game scores.
+
+    def __init__(self, elo0=0.0, elo1=10.0, alpha=0.05, beta=0.05):
+        self.wins = 0
+        self.draws = 0
+        self.losses = 0
+        self.elo0 = elo0
+        self.elo1 = elo1
+        self.lower_bound = math.log(beta / (1.0 - alpha))
+        self.upper_bound = math.log((1.0 - beta) / alpha)
+
+    @property
+    def games(self):
+        return self.wins + self.draws + self.losses
+
+    def add(self, score_a):
+        if score_a == 1.0:
+            self.wins += 1
+        elif score_a == 0.0:
+            self.losses += 1
+        else:
+            self.draws += 1
+
+    def score(self):
+        return (self.wins + 0.5 * self.draws) / self.games if self.games else 0.5
+
+    def variance(self):
+        # Variance of the score of a single game
+        if not self.games:
+            return 0.0
+        score = self.score()
+        return (self.wins * (1.0 - score) ** 2 + self.draws * (0.5 - score) ** 2 + self.losses * score ** 2) / self.games
+
+    def elo(self):
+        # Return the estimated Elo difference of A over B and its 95% error margin
+        score = self.score()
+        elo = elo_from_score(score)
+        if not self.games or not 0.0 < score < 1.0:
+            return elo, float('inf')
+        margin = 1.96 * math.sqrt(self.variance() / self.games)
+        return elo, (elo_from_score(min(score + margin, 1.0)) - elo_from_score(max(score - margin, 0.0))) / 2.0
+
+    def llr(self):
+        # Log-likelihood ratio of H1 against H0 for the games played so far
+        variance = self.variance()
+        if not variance:
+            return 0.0
+        score0 = expected_score(self.elo0)
+        score1 = expected_score(self.elo1)
+        return self.games * (score1 - score0) * (2.0 * self.score() - score0 - score1) / (2.0 * variance)
+
+    def sprt_result(self):
+        # Return "H1" or "H0" when the test has decided, otherwise None
+        llr = self.llr()
+        if llr >= self.upper_bound:
+            return "H1"
+        if llr <= self.lower_bound:
+            return "H0"
+        return None
+
+    def summary(self):
+        elo, margin = self.elo()
+        decision = {"H1": "accept H1", "H0": "accept H0", None: "continue"}[self.sprt_result()]
+        return ("games %d: +%d =%d -%d, score %.3f, Elo %+.1f +/- %.1f, SPRT [%g, %g] LLR %.2f (%.2f, %.2f) %s" % (
+            self.games, self.wins, self.draws, self.losses, self.score(), elo, margin,
+            self.elo0, self.elo1, self.llr(), self.lower_bound, self.upper_bound, decision))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play engine A against engine B without a window and summarize the results.")
+    parser.add_argument("--games", type=int, default=100, help="number of games, played in pairs with the colors swapped")
+    parser.add_argument("--depth", type=int, help="search depth of both engines, 0 for no depth limit (default %d when no time is given)" % DEFAULT_DEPTH)
+    parser.add_argument("--depth-a", type=int, help="search depth of engine A, overriding --depth")
+    parser.add_argument("--depth-b", type=int, help="search depth of engine B, overriding --depth")
+    parser.add_argument("--time-ms", type=int, help="time per move of both engines, in milliseconds, 0 for no time limit")
+    parser.add_argument("--time-a", type=int, help="time per move of engine A, overriding --time-ms")
+    parser.add_argument("--time-b", type=int, help="time per move of engine B, overriding --time-ms")
+    parser.add_argument("--quiescence-a", type=int, default=QUIESCENCE_NODE_BUDGET, help="quiescence node budget of engine A, 0 to turn it off")
+    parser.add_argument("--quiescence-b", type=int, default=QUIESCENCE_NODE_BUDGET, help="quiescence node budget of engine B, 0 to turn it off")
+    parser.add_argument("--tablebase", help="endgame tablebase file used by both engines")
+    parser.add_argument("--opening-plies", type=int, default=4, help="random moves played before the engines take over")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the random openings")
+    parser.add_argument("--workers", type=int, default=default_worker_count(), help="number of games played at the same time")
+    parser.add_argument("--output", default="arena.jsonl", help="JSONL file that receives one line per finished game")
+    parser.add_argument("--elo0", type=float, default=0.0, help="Elo difference of the SPRT null hypothesis")
+    parser.add_argument("--elo1", type=float, default=10.0, help="Elo difference of the SPRT alternative hypothesis")
+    parser.add_argument("--sprt", action="store_true", help="stop as soon as the SPRT has decided")
+    args = parser.parse_args(argv)
+
+    engines = {}
+    for name, depth, time_ms, quiescence_budget in (("A", args.depth_a, args.time_a, args.quiescence_a), ("B", args.depth_b, args.time_b, args.quiescence_b)):
+        try:
+            depth, time_ms = engine_limits(depth if depth is not None else args.depth, time_ms if time_ms is not None else args.time_ms)
+        except ValueError as error:
+            parser.error("engine %s %s" % (name, error))
+        engines[name] = engine_config(depth, time_ms, quiescence_budget, args.tablebase)
+    stats = MatchStats(args.elo0, args.elo1)
+    with open(args.output, "w") as output, ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(play_game, game, engines, "A" if game % 2 == 0 else "B", args.opening_plies, args.seed)
+                   for game in range(args.games)]
+        try:
+            for future in as_completed(futures):
+                record = future.result()
+                record["engines"] = engines
+                output.write(json.dumps(record) + "\n")
+                output.flush()
+                stats.add(record["score_a"])
+                print(stats.summary(), flush=True)
+                if args.sprt and stats.sprt_result() is not None:
+                    break
+        finally:
+            for future in futures:
+                future.cancel()
+    print(stats.summary())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
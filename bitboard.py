@@ -0,0 +1,780 @@
+import json
+import os
+import random
+
+# Constants for the bitboard engine
+BOARD_SIZE = 8
+SQUARES = 32
+FULL_MASK = 0xFFFFFFFF
+BLACK = "black"
+WHITE = "white"
+BLACK_KING = "gray"
+WHITE_KING = "gold"
+
+# The 32 dark squares are numbered row by row from the top of the board, four per row.
+# Square 0 is (0, 1), square 3 is (0, 7), square 4 is (1, 0) and square 31 is (7, 6).
+# White starts on squares 0-11 and moves down the board, black starts on squares 20-31 and moves up.
+# The notation of moves and positions uses the standard checkers (PDN) numbers 1-32 instead, counted from black's side of the board:
+# 1 is square 31 and 32 is square 0, so black starts on 1-12 and white on 21-32 (see square_to_number).
+UP_LEFT, UP_RIGHT, DOWN_LEFT, DOWN_RIGHT = range(4)
+DIRECTION_DELTAS = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+BLACK_DIRECTIONS = (UP_LEFT, UP_RIGHT)
+WHITE_DIRECTIONS = (DOWN_LEFT, DOWN_RIGHT)
+KING_DIRECTIONS = (UP_LEFT, UP_RIGHT, DOWN_LEFT, DOWN_RIGHT)
+BLACK_PROMOTION_MASK = 0x0000000F
+WHITE_PROMOTION_MASK = 0xF0000000
+INITIAL_WHITE_MEN = 0x00000FFF
+INITIAL_BLACK_MEN = 0xFFF00000
+
+
+def square_to_row_col(square):
+    # Convert a dark square index (0-31) to its (row, col) coordinates on the 8x8 board
+    row = square // 4
+    col = 2 * (square % 4) + (1 if row % 2 == 0 else 0)
+    return row, col
+
+
+def row_col_to_square(row, col):
+    # Convert (row, col) coordinates to a dark square index, or None for light and off-board squares
+    if not (0 <= row < BOARD_SIZE and 0 <= col < BOARD_SIZE) or (row + col) % 2 == 0:
+        return None
+    return row * 4 + col // 2
+
+
+def square_to_number(square):
+    # Convert a dark square index to its number in checkers notation
+    return SQUARES - square
+
+
+def number_to_square(number):
+    # Convert a square number of checkers notation (1-32) to its dark square index
+    return SQUARES - number
+
+
+def _build_tables():
+    # Precompute, for every square and direction, the adjacent square and the landing square of a jump (-1 when off the board).
+    # The shift-and-mask table groups the squares of each direction by the index delta of their step, so a whole mask can be moved with one shift per group.
+    neighbors = [[-1] * SQUARES for _ in range(4)]
+    jumps = [[-1] * SQUARES for _ in range(4)]
+    shifts = [{} for _ in range(4)]
+    for square in range(SQUARES):
+        row, col = square_to_row_col(square)
+        for direction, (d_row, d_col) in enumerate(DIRECTION_DELTAS):
+            neighbor = row_col_to_square(row + d_row, col + d_col)
+            if neighbor is None:
+                continue
+            neighbors[direction][square] = neighbor
+            delta = neighbor - square
+            shifts[direction][delta] = shifts[direction].get(delta, 0) | (1 << square)
+            jump = row_col_to_square(row + 2 * d_row, col + 2 * d_col)
+            if jump is not None:
+                jumps[direction][square] = jump
+    shifts = [tuple(sorted(groups.items())) for groups in shifts]
+    return neighbors, jumps, shifts
+
+
+NEIGHBORS, JUMPS, SHIFTS = _build_tables()
+
+# Zobrist keys: one random 64-bit number per piece type per square, plus one that is mixed in when white is to move.
+# The generator is seeded so that hashes are the same in every process, which lets hashes be stored in files and shared between workers.
+BLACK_MAN_INDEX, BLACK_KING_INDEX, WHITE_MAN_INDEX, WHITE_KING_INDEX = range(4)
+_zobrist_random = random.Random(0x5EED)
+ZOBRIST = [[_zobrist_random.getrandbits(64) for _ in range(SQUARES)] for _ in range(4)]
+ZOBRIST_WHITE_TO_MOVE = _zobrist_random.getrandbits(64)
+
+# Features of the evaluation. Each side scores the sum of weight * feature over these features, and the evaluation is white's total less black's:
+#   man, king    material: one per man and one per king
+#   advancement  one per row each man has advanced from its own back row
+#   back_rank    one per man still on its own back row, which keeps the opponent from crowning there
+#   center       one per man or king on the four center squares
+#   mobility     one per quiet move the side has (ignoring that captures are mandatory)
+#   tempo        one for the side to move
+# Weights are integers in hundredths of a man (FEATURE_SCALE). The first five features depend only on which piece stands on which square,
+# so they are summed incrementally as integers, without rounding drift, as pieces move. Mobility and tempo are only computed when their weight is not 0.
+# The weights can be fitted to game results with tuner.py; when the file EVALUATION_WEIGHTS_PATH exists next to this module, its weights replace the defaults.
+FEATURE_SCALE = 100
+FEATURE_NAMES = ("man", "king", "advancement", "back_rank", "center", "mobility", "tempo")
+SQUARE_FEATURE_NAMES = FEATURE_NAMES[:5]
+DEFAULT_EVALUATION_WEIGHTS = {"man": 100, "king": 150, "advancement": 2, "back_rank": 10, "center": 5, "mobility": 0, "tempo": 0}
+EVALUATION_WEIGHTS_FILE = "evaluation_weights.json"
+EVALUATION_WEIGHTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), EVALUATION_WEIGHTS_FILE)
+CENTER_SQUARES = (13, 14, 17, 18)
+
+
+def _build_square_feature_counts():
+    # For every square feature, the count each piece type (indexed like ZOBRIST) adds to its side's feature on each square
+    counts = {name: [[0] * SQUARES for _ in range(4)] for name in SQUARE_FEATURE_NAMES}
+    for square in range(SQUARES):
+        row = square // 4
+        counts["man"][BLACK_MAN_INDEX][square] = counts["man"][WHITE_MAN_INDEX][square] = 1
+        counts["king"][BLACK_KING_INDEX][square] = counts["king"][WHITE_KING_INDEX][square] = 1
+        counts["advancement"][BLACK_MAN_INDEX][square] = BOARD_SIZE - 1 - row
+        counts["advancement"][WHITE_MAN_INDEX][square] = row
+        counts["back_rank"][BLACK_MAN_INDEX][square] = 1 if row == BOARD_SIZE - 1 else 0
+        counts["back_rank"][WHITE_MAN_INDEX][square] = 1 if row == 0 else 0
+        if square in CENTER_SQUARES:
+            for index in range(4):
+                counts["center"][index][square] = 1
+    return counts
+
+
+SQUARE_FEATURE_COUNTS = _build_square_feature_counts()
+
+
+def _build_feature_tables(weights):
+    # Precompute the weighted score of the square features of each piece type (indexed like ZOBRIST) on each square
+    tables = [[0] * SQUARES for _ in range(4)]
+    for name in SQUARE_FEATURE_NAMES:
+        weight = weights[name]
+        for index in range(4):
+            for square in range(SQUARES):
+                tables[index][square] += weight * SQUARE_FEATURE_COUNTS[name][index][square]
+    return tables
+
+
+EVALUATION_WEIGHTS = dict(DEFAULT_EVALUATION_WEIGHTS)
+FEATURES = _build_feature_tables(EVALUATION_WEIGHTS)
+
+
+def set_evaluation_weights(weights):
+    # Install a new set of evaluation weights: a dict with some or all of the keys of FEATURE_NAMES, in hundredths of a man.
+    # The incremental feature scores of positions created before the call are based on the old weights, so call it before creating positions.
+    unknown = set(weights) - set(FEATURE_NAMES)
+    if unknown:
+        raise ValueError("unknown evaluation features: %s" % ", ".join(sorted(unknown)))
+    EVALUATION_WEIGHTS.update((name, int(round(weight))) for name, weight in weights.items())
+    FEATURES[:] = _build_feature_tables(EVALUATION_WEIGHTS)
+
+
+def load_evaluation_weights(path):
+    # Install the weights of a JSON file written by tuner.py
+    with open(path) as f:
+        set_evaluation_weights(json.load(f)["weights"])
+
+
+if os.path.exists(EVALUATION_WEIGHTS_PATH):
+    load_evaluation_weights(EVALUATION_WEIGHTS_PATH)
+
+# A move is packed into a single integer: the from square in bits 0-4, the to square in bits 5-9 and the mask of captured squares from bit 10 up.
+# Integers are cheaper to build, compare, hash and store than tuples, and the low ten bits (from and to) index the history table of the search directly.
+MOVE_TO_SHIFT = 5
+MOVE_CAPTURED_SHIFT = 10
+MOVE_SQUARE_MASK = 0x1F
+MOVE_PATH_MASK = 0x3FF
+
+
+def pack_move(from_square, to_square, captured=0):
+    return from_square | to_square << MOVE_TO_SHIFT | captured << MOVE_CAPTURED_SHIFT
+
+
+def unpack_move(move):
+    # Return (from_square, to_square, captured_mask) of a packed move
+    return move & MOVE_SQUARE_MASK, (move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK, move >> MOVE_CAPTURED_SHIFT
+
+
+def iter_bits(mask):
+    # Yield the square index of every set bit in the mask, lowest first
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def squares_to_mask(squares):
+    # Build a bitmask from an iterable of square indices
+    mask = 0
+    for square in squares:
+        mask |= 1 << square
+    return mask
+
+
+class Position:
+    # The Position class is a headless representation of a checkers position.
+    # Black men, black kings, white men and white kings are each stored as a 32-bit mask over the 32 dark squares.
+    # Quiet moves are generated for all pieces at once by shifting the masks, while jumps are found with the precomputed jump tables.
+    # A move is a packed integer holding its from square, to square and captured mask (see pack_move); quiet moves have an empty captured mask.
+    # The move generators take an optional list to reuse for their result, so that a search can keep one list per ply instead of allocating a new one at every node.
+    # Moves are played in place with apply, which returns an undo record that undo uses to restore the position.
+    # The Zobrist hash of the position, including the side to move, is kept in hash and updated incrementally by apply, undo and set_turn.
+    # In the same way, counts holds the number of black men, black kings, white men and white kings (indexed like ZOBRIST)
+    # and features the positional feature score of black and white, so that evaluate and is_game_over never scan the board.
+
+    __slots__ = ("black_men", "black_kings", "white_men", "white_kings", "turn", "hash", "counts", "features")
+
+    def __init__(self, black_men=0, black_kings=0, white_men=0, white_kings=0, turn=BLACK):
+        self.black_men = black_men
+        self.black_kings = black_kings
+        self.white_men = white_men
+        self.white_kings = white_kings
+        self.turn = turn
+        self.hash = self.compute_hash()
+        self.counts, self.features = self.compute_counters()
+
+    @classmethod
+    def initial(cls):
+        # Create the starting position with twelve men per side
+        return cls(black_men=INITIAL_BLACK_MEN, white_men=INITIAL_WHITE_MEN)
+
+    @classmethod
+    def from_board(cls, board, turn=BLACK):
+        # Create a position from the 8x8 list-of-strings board used by the user interface
+        masks = {BLACK: 0, BLACK_KING: 0, WHITE: 0, WHITE_KING: 0}
+        for square in range(SQUARES):
+            row, col = square_to_row_col(square)
+            piece = board[row][col]
+            if piece in masks:
+                masks[piece] |= 1 << square
+        return cls(masks[BLACK], masks[BLACK_KING], masks[WHITE], masks[WHITE_KING], turn)
+
+    def to_board(self):
+        # Convert the position back to the 8x8 list-of-strings board used by the user interface
+        board = [["" for _ in range(BOARD_SIZE)] for _ in range(BOARD_SIZE)]
+        for square in range(SQUARES):
+            piece = self.piece_at(square)
+            if piece:
+                row, col = square_to_row_col(square)
+                board[row][col] = piece
+        return board
+
+    def compute_hash(self):
+        # Compute the Zobrist hash of the position from scratch
+        key = ZOBRIST_WHITE_TO_MOVE if self.turn == WHITE else 0
+        for index, mask in enumerate((self.black_men, self.black_kings, self.white_men, self.white_kings)):
+            keys = ZOBRIST[index]
+            for square in iter_bits(mask):
+                key ^= keys[square]
+        return key
+
+    def compute_counters(self):
+        # Count the pieces of each type and sum the positional features of each side from scratch.
+        # Returns (counts, features) as kept in the counts and features attributes.
+        counts = [0] * 4
+        features = [0, 0]
+        for index, mask in enumerate((self.black_men, self.black_kings, self.white_men, self.white_kings)):
+            counts[index] = mask.bit_count()
+            table = FEATURES[index]
+            for square in iter_bits(mask):
+                features[index >> 1] += table[square]
+        return counts, features
+
+    def set_turn(self, color):
+        # Set the side to move, keeping the hash up to date
+        if color != self.turn:
+            self.turn = color
+            self.hash ^= ZOBRIST_WHITE_TO_MOVE
+
+    def copy(self):
+        return Position(self.black_men, self.black_kings, self.white_men, self.white_kings, self.turn)
+
+    def assign(self, other):
+        # Make this position a copy of another one, in place
+        self.black_men = other.black_men
+        self.black_kings = other.black_kings
+        self.white_men = other.white_men
+        self.white_kings = other.white_kings
+        self.turn = other.turn
+        self.hash = other.hash
+        self.counts = list(other.counts)
+        self.features = list(other.features)
+
+    def __eq__(self, other):
+        return isinstance(other, Position) and (
+            self.black_men, self.black_kings, self.white_men, self.white_kings, self.turn) == (
+            other.black_men, other.black_kings, other.white_men, other.white_kings, other.turn)
+
+    def __repr__(self):
+        return "Position(black_men=0x%08x, black_kings=0x%08x, white_men=0x%08x, white_kings=0x%08x, turn=%r)" % (
+            self.black_men, self.black_kings, self.white_men, self.white_kings, self.turn)
+
+    def piece_at(self, square):
+        # Return the piece color string on a square, or "" when it is empty
+        bit = 1 << square
+        if self.black_men & bit:
+            return BLACK
+        if self.black_kings & bit:
+            return BLACK_KING
+        if self.white_men & bit:
+            return WHITE
+        if self.white_kings & bit:
+            return WHITE_KING
+        return ""
+
+    def occupied(self):
+        return self.black_men | self.black_kings | self.white_men | self.white_kings
+
+    def empty(self):
+        return ~self.occupied() & FULL_MASK
+
+    def pieces(self, color):
+        # Return the men and kings masks of a side
+        if color == BLACK:
+            return self.black_men, self.black_kings
+        return self.white_men, self.white_kings
+
+    def opponents(self, color):
+        # Return the men and kings masks of the side playing against the given color
+        if color == BLACK:
+            return self.white_men, self.white_kings
+        return self.black_men, self.black_kings
+
+    def get_quiet_moves(self, color, pieces_mask=FULL_MASK, moves=None):
+        # Generate the non-capturing moves of a side, optionally restricted to the pieces in pieces_mask.
+        # Men step diagonally forward and kings step diagonally in any direction, one square at a time.
+        # When moves is given, that list is cleared and filled instead of a new one.
+        men, kings = self.pieces(color)
+        men &= pieces_mask
+        kings &= pieces_mask
+        empty = self.empty()
+        forward = BLACK_DIRECTIONS if color == BLACK else WHITE_DIRECTIONS
+        if moves is None:
+            moves = []
+        else:
+            moves.clear()
+        for direction in KING_DIRECTIONS:
+            movers = (men | kings) if direction in forward else kings
+            if not movers:
+                continue
+            for delta, mask in SHIFTS[direction]:
+                sources = movers & mask
+                if not sources:
+                    continue
+                targets = (sources << delta if delta > 0 else sources >> -delta) & empty
+                for to_square in iter_bits(targets):
+                    moves.append(to_square - delta | to_square << MOVE_TO_SHIFT)
+        return moves
+
+    def get_jumpers(self, color, pieces_mask=FULL_MASK):
+        # Return the mask of pieces of a side that have at least one capture available
+        men, kings = self.pieces(color)
+        men &= pieces_mask
+        kings &= pieces_mask
+        opponent_men, opponent_kings = self.opponents(color)
+        opponents = opponent_men | opponent_kings
+        empty = self.empty()
+        forward = BLACK_DIRECTIONS if color == BLACK else WHITE_DIRECTIONS
+        jumpers = 0
+        for direction in KING_DIRECTIONS:
+            movers = (men | kings) if direction in forward else kings
+            if not movers:
+                continue
+            # A piece can jump when its neighbor holds an opponent and the square beyond it is empty.
+            # Step the empty squares backwards twice, through opponent squares, to find the pieces that can make the jump.
+            back = direction ^ 3  # the opposite diagonal
+            targets = self._shift(self._shift(empty, back) & opponents, back)
+            jumpers |= movers & targets
+        return jumpers
+
+    @staticmethod
+    def _shift(mask, direction):
+        # Move every bit of the mask one diagonal step in the given direction, dropping bits that leave the board
+        result = 0
+        for delta, group in SHIFTS[direction]:
+            bits = mask & group
+            if bits:
+                result |= bits << delta if delta > 0 else bits >> -delta
+        return result & FULL_MASK
+
+    def get_captures(self, color, pieces_mask=FULL_MASK, partial=False, moves=None):
+        # Generate the capture moves of a side, optionally restricted to the pieces in pieces_mask.
+        # Every move is a complete multi-jump chain. A man that is crowned during a chain, either by reaching the far row or by capturing a king (regicide), ends its move there.
+        # With partial=True the intermediate steps of every chain are returned as well, which is what the user interface needs to let the player jump one square at a time.
+        # When moves is given, that list is cleared and filled instead of a new one.
+        if moves is None:
+            captures = []
+        else:
+            captures = moves
+            captures.clear()
+        men, kings = self.pieces(color)
+        jumpers = self.get_jumpers(color, pieces_mask)
+        if not jumpers:
+            return captures
+        opponent_men, opponent_kings = self.opponents(color)
+        opponents = opponent_men | opponent_kings
+        empty = self.empty()
+        forward = BLACK_DIRECTIONS if color == BLACK else WHITE_DIRECTIONS
+        promotion = BLACK_PROMOTION_MASK if color == BLACK else WHITE_PROMOTION_MASK
+        for square in iter_bits(jumpers):
+            is_king = bool(kings & (1 << square))
+            directions = KING_DIRECTIONS if is_king else forward
+            self._capture_chains(square, square, 0, is_king, directions, opponents, opponent_kings, empty, promotion,
+                                 captures, partial)
+        return captures
+
+    def _capture_chains(self, origin, square, captured, is_king, directions, opponents, opponent_kings, empty, promotion,
+                        captures, partial):
+        # Recursively follow the jumps available from square and append the resulting moves to captures.
+        # Captured pieces are taken off the board straight away, and the square the piece jumps from becomes empty.
+        # Returns True when at least one jump was possible from square.
+        extended = False
+        for direction in directions:
+            middle = NEIGHBORS[direction][square]
+            if middle < 0 or not (opponents >> middle) & 1:
+                continue
+            landing = JUMPS[direction][square]
+            if landing < 0 or not (empty >> landing) & 1:
+                continue
+            extended = True
+            middle_bit = 1 << middle
+            move_captured = captured | middle_bit
+            move = origin | landing << MOVE_TO_SHIFT | move_captured << MOVE_CAPTURED_SHIFT
+            if partial and move not in captures:
+                captures.append(move)
+            crowned = not is_king and ((1 << landing) & promotion or middle_bit & opponent_kings)
+            continued = False
+            if not crowned:
+                next_empty = (empty | (1 << square) | middle_bit) & ~(1 << landing)
+                continued = self._capture_chains(origin, landing, move_captured, is_king, directions,
+                                                 opponents & ~middle_bit, opponent_kings & ~middle_bit, next_empty,
+                                                 promotion, captures, partial)
+            if not continued and not partial and move not in captures:
+                captures.append(move)
+        return extended
+
+    def get_capture_path(self, move):
+        # Return the landing squares of a capture move in jump order, so the user interface can show one jump at a time.
+        # A capture move only records its captured squares, so the path is found again by following jumps over exactly those squares.
+        from_square, to_square, captured = unpack_move(move)
+        piece = self.piece_at(from_square)
+        if piece in [BLACK_KING, WHITE_KING]:
+            directions = KING_DIRECTIONS
+        else:
+            directions = BLACK_DIRECTIONS if piece == BLACK else WHITE_DIRECTIONS
+
+        def follow(square, remaining, empty):
+            if not remaining:
+                return [] if square == to_square else None
+            for direction in directions:
+                middle = NEIGHBORS[direction][square]
+                landing = JUMPS[direction][square]
+                if middle < 0 or landing < 0 or not (remaining >> middle) & 1 or not (empty >> landing) & 1:
+                    continue
+                middle_bit = 1 << middle
+                path = follow(landing, remaining & ~middle_bit, (empty | (1 << square) | middle_bit) & ~(1 << landing))
+                if path is not None:
+                    return [landing] + path
+            return None
+
+        return follow(from_square, captured, self.empty()) or [to_square]
+
+    def apply(self, move):
+        # Play a move in place and return the undo record needed to take it back.
+        # The moving piece is crowned when a man reaches the far row or captures a king (regicide), and the captured pieces are removed.
+        # The opponent of the moving piece is to move afterwards. The side key of the hash only changes when that changes the side to move,
+        # so that playing a multi-step capture one jump at a time, as the user interface does, keeps the hash equal to compute_hash().
+        # The undo record is (from_square, to_square, captured_men, captured_kings, promoted, previous_hash, previous_black_features, previous_white_features).
+        from_square = move & MOVE_SQUARE_MASK
+        to_square = (move >> MOVE_TO_SHIFT) & MOVE_SQUARE_MASK
+        captured = move >> MOVE_CAPTURED_SHIFT
+        from_bit = 1 << from_square
+        to_bit = 1 << to_square
+        previous_hash = key = self.hash
+        features = self.features
+        previous_black_features, previous_white_features = features
+        if (self.black_men | self.black_kings) & from_bit:
+            captured_men = self.white_men & captured
+            captured_kings = self.white_kings & captured
+            self.white_men ^= captured_men
+            self.white_kings ^= captured_kings
+            man_index, king_index, captured_man_index, captured_king_index = (
+                BLACK_MAN_INDEX, BLACK_KING_INDEX, WHITE_MAN_INDEX, WHITE_KING_INDEX)
+            if self.black_kings & from_bit:
+                promoted = False
+                moved_index = landed_index = king_index
+                self.black_kings ^= from_bit ^ to_bit
+            else:
+                promoted = bool(to_bit & BLACK_PROMOTION_MASK or captured_kings)
+                moved_index = man_index
+                self.black_men ^= from_bit
+                if promoted:
+                    landed_index = king_index
+                    self.black_kings |= to_bit
+                else:
+                    landed_index = man_index
+                    self.black_men |= to_bit
+            side = 0
+            side_key = ZOBRIST_WHITE_TO_MOVE if self.turn != WHITE else 0
+            self.turn = WHITE
+        else:
+            captured_men = self.black_men & captured
+            captured_kings = self.black_kings & captured
+            self.black_men ^= captured_men
+            self.black_kings ^= captured_kings
+            man_index, king_index, captured_man_index, captured_king_index = (
+                WHITE_MAN_INDEX, WHITE_KING_INDEX, BLACK_MAN_INDEX, BLACK_KING_INDEX)
+            if self.white_kings & from_bit:
+                promoted = False
+                moved_index = landed_index = king_index
+                self.white_kings ^= from_bit ^ to_bit
+            else:
+                promoted = bool(to_bit & WHITE_PROMOTION_MASK or captured_kings)
+                moved_index = man_index
+                self.white_men ^= from_bit
+                if promoted:
+                    landed_index = king_index
+                    self.white_kings |= to_bit
+                else:
+                    landed_index = man_index
+                    self.white_men |= to_bit
+            side = 1
+            side_key = ZOBRIST_WHITE_TO_MOVE if self.turn != BLACK else 0
+            self.turn = BLACK
+
+        # Update the hash, the piece counts and the feature scores for the moved piece, the captured pieces and the side to move
+        key ^= ZOBRIST[moved_index][from_square] ^ ZOBRIST[landed_index][to_square] ^ side_key
+        features[side] += FEATURES[landed_index][to_square] - FEATURES[moved_index][from_square]
+        if promoted:
+            counts = self.counts
+            counts[moved_index] -= 1
+            counts[landed_index] += 1
+        if captured_men:
+            keys = ZOBRIST[captured_man_index]
+            table = FEATURES[captured_man_index]
+            for square in iter_bits(captured_men):
+                key ^= keys[square]
+                features[side ^ 1] -= table[square]
+            self.counts[captured_man_index] -= captured_men.bit_count()
+        if captured_kings:
+            keys = ZOBRIST[captured_king_index]
+            table = FEATURES[captured_king_index]
+            for square in iter_bits(captured_kings):
+                key ^= keys[square]
+                features[side ^ 1] -= table[square]
+            self.counts[captured_king_index] -= captured_kings.bit_count()
+        self.hash = key
+        return from_square, to_square, captured_men, captured_kings, promoted, previous_hash, previous_black_features, previous_white_features
+
+    def undo(self, record):
+        # Take back a move played with apply, using the undo record it returned
+        from_square, to_square, captured_men, captured_kings, promoted, previous_hash, previous_black_features, previous_white_features = record
+        self.hash = previous_hash
+        features = self.features
+        features[0] = previous_black_features
+        features[1] = previous_white_features
+        counts = self.counts
+        from_bit = 1 << from_square
+        to_bit = 1 << to_square
+        if (self.black_men | self.black_kings) & to_bit:
+            if promoted:
+                self.black_kings ^= to_bit
+                self.black_men |= from_bit
+                counts[BLACK_KING_INDEX] -= 1
+                counts[BLACK_MAN_INDEX] += 1
+            elif self.black_kings & to_bit:
+                self.black_kings ^= from_bit ^ to_bit
+            else:
+                self.black_men ^= from_bit ^ to_bit
+            if captured_men or captured_kings:
+                self.white_men |= captured_men
+                self.white_kings |= captured_kings
+                counts[WHITE_MAN_INDEX] += captured_men.bit_count()
+                counts[WHITE_KING_INDEX] += captured_kings.bit_count()
+            self.turn = BLACK
+        else:
+            if promoted:
+                self.white_kings ^= to_bit
+                self.white_men |= from_bit
+                counts[WHITE_KING_INDEX] -= 1
+                counts[WHITE_MAN_INDEX] += 1
+            elif self.white_kings & to_bit:
+                self.white_kings ^= from_bit ^ to_bit
+            else:
+                self.white_men ^= from_bit ^ to_bit
+            if captured_men or captured_kings:
+                self.black_men |= captured_men
+                self.black_kings |= captured_kings
+                counts[BLACK_MAN_INDEX] += captured_men.bit_count()
+                counts[BLACK_KING_INDEX] += captured_kings.bit_count()
+            self.turn = WHITE
+
+    def has_moves(self, color):
+        # Return True when a side has at least one legal move, found with mask shifts without generating the moves
+        men, kings = self.pieces(color)
+        empty = self.empty()
+        forward = BLACK_DIRECTIONS if color == BLACK else WHITE_DIRECTIONS
+        for direction in KING_DIRECTIONS:
+            movers = (men | kings) if direction in forward else kings
+            if movers and self._shift(movers, direction) & empty:
+                return True
+        return bool(self.get_jumpers(color))
+
+    def is_game_over(self, color=None):
+        # The game is over when either side has no pieces left, or when the side to move (color, by default the side whose turn it is) has no legal move
+        counts = self.counts
+        if not (counts[BLACK_MAN_INDEX] + counts[BLACK_KING_INDEX]) or not (counts[WHITE_MAN_INDEX] + counts[WHITE_KING_INDEX]):
+            return True
+        return not self.has_moves(self.turn if color is None else color)
+
+    def loser(self, color=None):
+        # Return the color of the side that has lost a finished game: the side without pieces, otherwise the side to move, which has no legal move
+        counts = self.counts
+        if not (counts[BLACK_MAN_INDEX] + counts[BLACK_KING_INDEX]):
+            return BLACK
+        if not (counts[WHITE_MAN_INDEX] + counts[WHITE_KING_INDEX]):
+            return WHITE
+        return self.turn if color is None else color
+
+    def evaluate(self):
+        # Score the position from white's (the AI's) point of view, in men: white's weighted features less black's (see FEATURE_NAMES).
+        # Material and the other square features come from the incremental feature scores; mobility and tempo are only added when they are weighted.
+        score = self.features[1] - self.features[0]
+        weights = EVALUATION_WEIGHTS
+        if weights["mobility"]:
+            score += weights["mobility"] * (self.mobility(WHITE) - self.mobility(BLACK))
+        if weights["tempo"]:
+            score += weights["tempo"] if self.turn == WHITE else -weights["tempo"]
+        return score / FEATURE_SCALE
+
+    def mobility(self, color):
+        # Count the quiet moves of a side with mask shifts, without generating them
+        men, kings = self.pieces(color)
+        empty = self.empty()
+        forward = BLACK_DIRECTIONS if color == BLACK else WHITE_DIRECTIONS
+        count = 0
+        for direction in KING_DIRECTIONS:
+            movers = (men | kings) if direction in forward else kings
+            if movers:
+                count += (self._shift(movers, direction) & empty).bit_count()
+        return count
+
+    def feature_values(self):
+        # Return the values of the features of FEATURE_NAMES, white's less black's, unweighted; the evaluation is their weighted sum.
+        # This is the reference for the batch version in evaluation.py.
+        values = []
+        masks = (self.black_men, self.black_kings, self.white_men, self.white_kings)
+        for name in SQUARE_FEATURE_NAMES:
+            value = 0
+            for index, mask in enumerate(masks):
+                table = SQUARE_FEATURE_COUNTS[name][index]
+                sign = 1 if index >= WHITE_MAN_INDEX else -1
+                for square in iter_bits(mask):
+                    value += sign * table[square]
+            values.append(value)
+        values.append(self.mobility(WHITE) - self.mobility(BLACK))
+        values.append(1 if self.turn == WHITE else -1)
+        return values
+
+    def get_moves(self, color):
+        # Return the quiet moves and the capture moves of a side. Captures are mandatory, so quiet moves are only legal when there are no captures.
+        return self.get_quiet_moves(color), self.get_captures(color)
+
+    def get_legal_moves(self, color, moves=None):
+        # Return the moves a side is allowed to play: its captures when it has any, otherwise its quiet moves.
+        # When moves is given, that list is cleared and filled instead of a new one.
+        captures = self.get_captures(color, moves=moves)
+        if captures:
+            return captures
+        return self.get_quiet_moves(color, moves=captures)
+
+
+def move_to_legacy(move):
+    # Convert an engine move into the tuple shape used by the user interface: ((row, col), (row, col)) for quiet moves
+    # and ((row, col), (row, col), [(row, col), ...]) for captures
+    from_square, to_square, captured = unpack_move(move)
+    start = square_to_row_col(from_square)
+    end = square_to_row_col(to_square)
+    if not captured:
+        return start, end
+    return start, end, [square_to_row_col(square) for square in iter_bits(captured)]
+
+
+def move_from_legacy(move):
+    # Convert a move in the user interface tuple shape into an engine move
+    from_square = row_col_to_square(*move[0])
+    to_square = row_col_to_square(*move[1])
+    captured = squares_to_mask(row_col_to_square(row, col) for row, col in (move[2] if len(move) > 2 else []))
+    return pack_move(from_square, to_square, captured)
+
+
+def format_move(position, move):
+    # Write a move of the side to move in the usual checkers notation, with the standard square numbers (see square_to_number):
+    # "11-15" for a quiet move and "9x18x27" for a capture, listing every landing square of the jumps
+    from_square, to_square, captured = unpack_move(move)
+    if not captured:
+        return "%d-%d" % (square_to_number(from_square), square_to_number(to_square))
+    return "x".join(str(square_to_number(square)) for square in [from_square] + position.get_capture_path(move))
+
+
+def parse_move(position, text):
+    # Find the legal move of the side to move written as text in the notation of format_move.
+    # A capture may also be written with just its first and last squares ("9x27") when that is not ambiguous.
+    # Raises ValueError when no legal move, or more than one, matches.
+    text = text.strip()
+    moves = position.get_legal_moves(position.turn)
+    for move in moves:
+        if format_move(position, move) == text:
+            return move
+    squares = text.split("x")
+    if len(squares) == 2:
+        try:
+            from_square, to_square = number_to_square(int(squares[0])), number_to_square(int(squares[1]))
+        except ValueError:
+            raise ValueError("invalid move %r" % text)
+        if not (0 <= from_square < SQUARES and 0 <= to_square < SQUARES):
+            raise ValueError("illegal move %r" % text)
+        matches = [move for move in moves if move >> MOVE_CAPTURED_SHIFT and move & MOVE_PATH_MASK == pack_move(from_square, to_square)]
+        if len(matches) == 1:
+            return matches[0]
+        if matches:
+            raise ValueError("ambiguous move %r, give every landing square" % text)
+    raise ValueError("illegal move %r" % text)
+
+
+def format_fen(position):
+    # Write a position in the FEN notation of PDN: the side to move, then the squares of the white and black pieces with K in front of kings,
+    # for example "B:W21,22,K14:B1,2,K30" (the start position is "B:W21-32:B1-12"). Squares have their standard numbers, as in format_move.
+    def pieces(letter, men, kings):
+        numbers = sorted([(square_to_number(square), "") for square in iter_bits(men)] + [(square_to_number(square), "K") for square in iter_bits(kings)])
+        return letter + ",".join(king + str(number) for number, king in numbers)
+
+    return "%s:%s:%s" % ("W" if position.turn == WHITE else "B", pieces("W", position.white_men, position.white_kings),
+                         pieces("B", position.black_men, position.black_kings))
+
+
+def parse_fen(text):
+    # Read a position written in the FEN notation of format_fen. The PDN tag form [FEN "..."], a final period and square ranges such as "1-12" or "K29-32" are accepted.
+    # Raises ValueError when the text is not a valid position.
+    fen = text.strip()
+    if fen.startswith("["):
+        start, end = fen.find('"'), fen.rfind('"')
+        if start < 0 or end <= start:
+            raise ValueError("invalid FEN tag %r" % text)
+        fen = fen[start + 1:end].strip()
+    fields = fen.rstrip(".").split(":")
+    if len(fields) != 3 or fields[0].upper() not in ("B", "W"):
+        raise ValueError("invalid FEN %r" % text)
+    masks = {BLACK: 0, BLACK_KING: 0, WHITE: 0, WHITE_KING: 0}
+    occupied = 0
+    colors = set()
+    for field in fields[1:]:
+        letter = field[:1].upper()
+        if letter not in ("B", "W") or letter in colors:
+            raise ValueError("invalid FEN %r" % text)
+        colors.add(letter)
+        for token in field[1:].split(","):
+            token = token.strip().upper()
+            if not token:
+                continue
+            king = token.startswith("K")
+            try:
+                first, _, last = token.lstrip("K").partition("-")
+                numbers = range(int(first), int(last or first) + 1)
+            except ValueError:
+                raise ValueError("invalid square %r in FEN %r" % (token, text))
+            for number in numbers:
+                if not 1 <= number <= SQUARES:
+                    raise ValueError("invalid square %d in FEN %r" % (number, text))
+                square = number_to_square(number)
+                if occupied >> square & 1:
+                    raise ValueError("square %d is given twice in FEN %r" % (number, text))
+                if letter == "B":
+                    piece = BLACK_KING if king else BLACK
+                    if not king and (1 << square) & BLACK_PROMOTION_MASK:
+                        raise ValueError("black man on its promotion row (square %d) in FEN %r" % (number, text))
+                else:
+                    piece = WHITE_KING if king else WHITE
+                    if not king and (1 << square) & WHITE_PROMOTION_MASK:
+                        raise ValueError("white man on its promotion row (square %d) in FEN %r" % (number, text))
+                masks[piece] |= 1 << square
+                occupied |= 1 << square
+    turn = WHITE if fields[0].upper() == "W" else BLACK
+    return Position(masks[BLACK], masks[BLACK_KING], masks[WHITE], masks[WHITE_KING], turn)
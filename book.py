@@ -0,0 +1,178 @@
+import argparse
+import json
+import mmap
+import random
+import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from bitboard import Position, format_move, parse_move, pack_move, unpack_move
+from arena import DEFAULT_VARIETY_MARGIN, engine_config, engine_limits, play_game
+from parallel import default_worker_count
+from search import QUIESCENCE_NODE_BUDGET
+
+# Opening book file format (all integers little-endian):
+#   header:  magic b"CKBK", version (u16), number of entries (u32)
+#   entries: one per (position, move), sorted by the Zobrist hash of the position (which includes the side to move):
+#            hash (u64), from square (u8), to square (u8), captured squares mask (u32), games played (u32), points scored by the side to move, in half points (u32)
+# Entries have a fixed size, so the entries of a position are found by binary search over the memory-mapped file without reading it into memory.
+MAGIC = b"CKBK"
+VERSION = 1
+HEADER = struct.Struct("<4sHI")
+ENTRY = struct.Struct("<QBBIII")
+DEFAULT_PATH = "opening.ckbk"
+DEFAULT_BOOK_DEPTH = 12
+DEFAULT_MIN_GAMES = 2
+# Plies at the start of each self-play game in which the engine picks among nearly equal moves, so that the games differ
+DEFAULT_VARIETY_PLIES = 8
+
+
+def collect(records, book_depth, statistics=None):
+    # Add the positions and moves of the first book_depth plies of each game record (in the JSONL format written by arena.py) to the statistics.
+    # The random opening moves of a record are played but not added, so only moves chosen by an engine go into the book.
+    # statistics maps (hash, move) to [games, half points scored by the side that played the move].
+    if statistics is None:
+        statistics = {}
+    for record in records:
+        result = record["result"]
+        position = Position.initial()
+        opening_plies = len(record["opening"])
+        for ply, text in enumerate((record["opening"] + record["moves"])[:book_depth]):
+            move = parse_move(position, text)
+            if ply >= opening_plies:
+                entry = statistics.setdefault((position.hash, move), [0, 0])
+                entry[0] += 1
+                entry[1] += 1 if result == "draw" else (2 if result == position.turn else 0)
+            position.apply(move)
+    return statistics
+
+
+def self_play(games, depth, time_ms, opening_plies, seed, workers, variety_plies=DEFAULT_VARIETY_PLIES, variety_margin=DEFAULT_VARIETY_MARGIN):
+    # Play games of the engine against itself on a process pool and yield their records as they finish.
+    # The search is deterministic, so the games get their variety from the engine choosing at random among nearly equal moves for the first variety_plies plies
+    # (see arena.choose_varied_move); every move of those plies is still one the engine rates, so they all go into the book, from the start position on.
+    # Random opening moves (opening_plies) can be added as well, but they are left out of the book.
+    # Both sides play the same engine, so unlike in arena.py games are not played in pairs: every game gets its own random choices.
+    config = engine_config(depth, time_ms, QUIESCENCE_NODE_BUDGET, None, variety_plies, variety_margin)
+    engines = {"A": config, "B": config}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(play_game, game, engines, "A", opening_plies, seed, game) for game in range(games)]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def write(statistics, path, min_games=DEFAULT_MIN_GAMES):
+    # Write the moves played at least min_games times to a book file, sorted by position hash. Returns the number of entries written.
+    entries = sorted((key, move, games, points) for (key, move), (games, points) in statistics.items() if games >= min_games)
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(entries)))
+        for key, move, games, points in entries:
+            f.write(ENTRY.pack(key, *unpack_move(move), games, points))
+    return len(entries)
+
+
+class OpeningBook:
+    # The OpeningBook class probes a book file written by write.
+    # choose picks a move for a position: with variety 0 always the move with the best average score (the most played one on ties),
+    # otherwise a random move among those whose average score is at most variety below the best, weighted by how often each was played.
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.size = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a checkers opening book" % path)
+        self.probes = 0
+        self.hits = 0
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def key_at(self, index):
+        return ENTRY.unpack_from(self.data, HEADER.size + index * ENTRY.size)[0]
+
+    def lookup(self, position):
+        # Return the book entries of a position as a list of (move, games, average score of the side to move), keeping only legal moves
+        self.probes += 1
+        key = position.hash
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if self.key_at(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        legal = position.get_legal_moves(position.turn)
+        entries = []
+        for index in range(low, self.size):
+            entry_key, from_square, to_square, captured, games, points = ENTRY.unpack_from(self.data, HEADER.size + index * ENTRY.size)
+            if entry_key != key:
+                break
+            move = pack_move(from_square, to_square, captured)
+            if move in legal:
+                entries.append((move, games, points / (2.0 * games)))
+        if entries:
+            self.hits += 1
+        return entries
+
+    def choose(self, position, variety=0.0, rng=random):
+        # Return a book move for the side to move of a position, or None when the position is not in the book
+        entries = self.lookup(position)
+        if not entries:
+            return None
+        best = max(entries, key=lambda entry: (entry[2], entry[1]))
+        if variety <= 0:
+            return best[0]
+        candidates = [entry for entry in entries if entry[2] >= best[2] - variety]
+        return rng.choices([entry[0] for entry in candidates], weights=[entry[1] for entry in candidates])[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build a checkers opening book from game records and self-play, or show the book moves of the start position.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="build a book file")
+    build_parser.add_argument("--games", nargs="*", default=[], help="JSONL game records written by arena.py")
+    build_parser.add_argument("--self-play", type=int, default=0, help="number of self-play games to add")
+    build_parser.add_argument("--depth", type=int, default=6, help="search depth of the self-play games")
+    build_parser.add_argument("--time-ms", type=int, help="time per move of the self-play games")
+    build_parser.add_argument("--variety-plies", type=int, default=DEFAULT_VARIETY_PLIES,
+                              help="plies at the start of each self-play game in which the engine picks among nearly equal moves")
+    build_parser.add_argument("--variety-margin", type=float, default=DEFAULT_VARIETY_MARGIN,
+                              help="largest score difference from the best move, in men, of the moves picked for variety")
+    build_parser.add_argument("--opening-plies", type=int, default=0, help="random moves at the start of each self-play game; they are not added to the book")
+    build_parser.add_argument("--seed", type=int, default=1)
+    build_parser.add_argument("--workers", type=int, default=default_worker_count())
+    build_parser.add_argument("--book-depth", type=int, default=DEFAULT_BOOK_DEPTH, help="number of plies of each game that go into the book")
+    build_parser.add_argument("--min-games", type=int, default=DEFAULT_MIN_GAMES, help="leave out moves played fewer times than this")
+    build_parser.add_argument("--output", default=DEFAULT_PATH)
+    show_parser = subparsers.add_parser("show", help="show the book moves of the start position")
+    show_parser.add_argument("path", nargs="?", default=DEFAULT_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        statistics = {}
+        for path in args.games:
+            with open(path) as f:
+                collect((json.loads(line) for line in f if line.strip()), args.book_depth, statistics)
+        if args.self_play:
+            try:
+                depth, time_ms = engine_limits(args.depth, args.time_ms)
+            except ValueError as error:
+                parser.error("self-play %s" % error)
+            collect(self_play(args.self_play, depth, time_ms, args.opening_plies, args.seed, args.workers, args.variety_plies, args.variety_margin),
+                    args.book_depth, statistics)
+        count = write(statistics, args.output, args.min_games)
+        print("%s: %d entries from %d positions" % (args.output, count, len({key for key, _ in statistics})))
+    else:
+        book = OpeningBook(args.path)
+        position = Position.initial()
+        print("%s: %d entries" % (args.path, book.size))
+        for move, games, score in sorted(book.lookup(position), key=lambda entry: -entry[1]):
+            print("  %s %6d games, score %.3f" % (format_move(position, move), games, score))
+        book.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
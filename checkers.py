@@ -1,7 +1,17 @@
 import tkinter as tk
-from tkinter import messagebox
+from tkinter import filedialog, messagebox
+import os
 import random
-import time
+import threading
+from bitboard import Position, MOVE_SQUARE_MASK, format_fen, parse_fen, move_from_legacy, move_to_legacy, row_col_to_square, square_to_row_col
+from search import Searcher
+from movecache import MoveCache
+from parallel import ParallelSearcher, create_pool, default_worker_count
+from ponder import Ponderer
+from tablebase import Tablebase, DEFAULT_PATH as TABLEBASE_FILE
+from book import OpeningBook, DEFAULT_PATH as BOOK_FILE
+from tracing import SearchTracer
+from transposition import TranspositionTable
 
 # Constants for the game
 BOARD_SIZE = 8
@@ -11,7 +21,26 @@ PLAYER_COLOR = "black"
 AI_COLOR = "white"
 PLAYER_KING_COLOR = "gray"
 AI_KING_COLOR = "gold"
+# Color of the crown marker drawn on each kind of king, chosen to stand out against the king's own color
+KING_MARKER_COLORS = {PLAYER_KING_COLOR: "black", AI_KING_COLOR: "brown"}
 AI_DEPTH = 3
+AI_TIME_MS = 250
+AI_WORKERS = 1
+TT_SIZE_MB = 64
+CAPTURE_DELAY_MS = 1000
+AI_POLL_MS = 50
+# Endgame tablebase used by the AI when the file exists, built with: python tablebase.py build
+TABLEBASE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), TABLEBASE_FILE)
+# Opening book used by the AI when the file exists, built with: python book.py build --self-play 1000
+BOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), BOOK_FILE)
+# How much worse (in average score) than the best book move a book move may be and still be played, so that the AI does not always open the same way
+BOOK_VARIETY = 0.1
+# Set SEARCH_TRACE_PATH to a file name to append a JSONL trace line with the statistics of every AI search to it,
+# and SEARCH_TRACE_PROFILE to True to also run the searches under cProfile (see tracing.py)
+SEARCH_TRACE_PATH = None
+SEARCH_TRACE_PROFILE = False
+# Files offered by the "Load position" and "Save position" dialogs: one line holding a position in FEN notation (see bitboard.format_fen)
+POSITION_FILE_TYPES = [("FEN position", "*.fen"), ("All files", "*")]
 
 class CheckersGame:
     # The CheckersGame class represents the main game logic and user interface for the game of checkers. It handles the initialization of the game window, game board, and user interactions.
@@ -27,6 +56,35 @@ class CheckersGame:
         self.canvas.pack()
         self.canvas.bind("<Button-1>", self.handle_player_move)
         self.selected_piece = None
+        self.create_board_items()
+
+        # The transposition table is kept for the whole game so that the AI can reuse the results of its previous searches
+        self.transposition_table = TranspositionTable(TT_SIZE_MB)
+        self.last_search_stats = None
+        # Process pool for the parallel search, created the first time a difficulty level that uses more than one worker searches
+        self.search_pool = None
+        self.search_pool_workers = 0
+        # The endgame tablebase gives the AI perfect play once few enough pieces are left. It is optional: without the file the AI just searches.
+        self.tablebase = Tablebase(TABLEBASE_PATH) if os.path.exists(TABLEBASE_PATH) else None
+        # With an opening book the AI answers straight away in the opening and keeps its time for later in the game
+        self.opening_book = OpeningBook(BOOK_PATH) if os.path.exists(BOOK_PATH) else None
+        self.search_tracer = SearchTracer(SEARCH_TRACE_PATH, SEARCH_TRACE_PROFILE) if SEARCH_TRACE_PATH else None
+
+        # The AI searches on a background thread. busy is set while the AI is thinking or a move is being shown, and clicks are ignored meanwhile.
+        # game_id changes on every restart so that timers and searches belonging to an earlier game can tell they are stale.
+        self.busy = False
+        self.game_id = 0
+        self.ai_thread = None
+        self.ai_result = None
+        # The exception raised by the background search, if it failed
+        self.ai_error = None
+        self.ai_stop_event = None
+
+        # While the player thinks, the AI can search ahead for its reply to the player's most likely moves (see ponder.py).
+        # ponder_moves counts the player moves made while pondering and ponder_hits the ones that had been predicted.
+        self.ponderer = None
+        self.ponder_moves = 0
+        self.ponder_hits = 0
 
         # Create a dropdown menu for difficulty levels
         self.difficulty_var = tk.StringVar(self.window)
@@ -36,30 +94,55 @@ class CheckersGame:
         difficulty_menu.pack()
         self.difficulty_var.trace("w", self.update_ai_depth)
 
-        # Create the initial board
-        self.board = [
-            ["", AI_COLOR, "", AI_COLOR, "", AI_COLOR, "", AI_COLOR],
-            [AI_COLOR, "", AI_COLOR, "", AI_COLOR, "", AI_COLOR, ""],
-            ["", AI_COLOR, "", AI_COLOR, "", AI_COLOR, "", AI_COLOR],
-            ["", "", "", "", "", "", "", ""],
-            ["", "", "", "", "", "", "", ""],
-            [PLAYER_COLOR, "", PLAYER_COLOR, "", PLAYER_COLOR, "", PLAYER_COLOR, ""],
-            ["", PLAYER_COLOR, "", PLAYER_COLOR, "", PLAYER_COLOR, "", PLAYER_COLOR],
-            [PLAYER_COLOR, "", PLAYER_COLOR, "", PLAYER_COLOR, "", PLAYER_COLOR, ""]
-        ]
+        # Create the initial position. The pieces are stored as bitboards, see the board property for the 8x8 view.
+        self.position = Position.initial()
+        # The moves of the positions shown recently: every click asks for the moves of the same position again
+        self.move_cache = MoveCache()
 
         # Create a button to show the rules
         rules_button = tk.Button(self.window, text="Rules", command=self.show_rules)
         rules_button.pack()
 
+        # Create a button that makes the AI stop thinking and move now
+        move_now_button = tk.Button(self.window, text="Move now", command=self.stop_ai_search)
+        move_now_button.pack()
+
+        # Create buttons to load a position from a FEN file and to save the current position to one
+        load_button = tk.Button(self.window, text="Load position", command=self.load_position)
+        load_button.pack()
+        save_button = tk.Button(self.window, text="Save position", command=self.save_position)
+        save_button.pack()
+
+        # Create a checkbox to turn pondering on and off
+        self.ponder_var = tk.BooleanVar(self.window, value=True)
+        ponder_checkbox = tk.Checkbutton(self.window, text="Think on player's time", variable=self.ponder_var,
+                                         command=self.update_pondering)
+        ponder_checkbox.pack()
+
+        # Create a checkbox that shows what the AI's last search did: depth, nodes, speed, branching factor, cutoff and hit rates
+        self.info_var = tk.BooleanVar(self.window, value=False)
+        info_checkbox = tk.Checkbutton(self.window, text="Show search info", variable=self.info_var, command=self.update_info_panel)
+        info_checkbox.pack()
+        self.info_label = tk.Label(self.window, justify="left", font=("Courier", 10))
+
+    @property
+    def board(self):
+        # The 8x8 list-of-strings view of the current position, as used by the drawing and click handling code
+        return self.position.to_board()
+
+    @board.setter
+    def board(self, board):
+        self.position = Position.from_board(board)
+
     def start(self):
         # Start the game
         self.draw_board()
         self.window.mainloop()
 
-    def draw_board(self):
-        # Draw the game board
-        self.canvas.delete("all")
+    def create_board_items(self):
+        # Create the canvas items of the board once: a rectangle for every square, and for every dark square a piece oval and a king marker,
+        # hidden while the square is empty. draw_board then only changes the items of the squares whose piece has changed.
+        self.piece_items = {}
         for row in range(BOARD_SIZE):
             for col in range(BOARD_SIZE):
                 x1 = col * SQUARE_SIZE
@@ -67,12 +150,40 @@ class CheckersGame:
                 x2 = x1 + SQUARE_SIZE
                 y2 = y1 + SQUARE_SIZE
                 if (row + col) % 2 == 0:
-                    self.canvas.create_rectangle(x1, y1, x2, y2, fill="DarkOrange")
+                    self.canvas.create_rectangle(x1, y1, x2, y2, fill="DarkOrange", tags="square")
                 else:
-                    self.canvas.create_rectangle(x1, y1, x2, y2, fill="chocolate")
-                if self.board[row][col] != "":
-                    piece_color = self.board[row][col]
-                    self.canvas.create_oval(x1 + 5, y1 + 5, x2 - 5, y2 - 5, fill=piece_color)
+                    self.canvas.create_rectangle(x1, y1, x2, y2, fill="chocolate", tags="square")
+                    oval = self.canvas.create_oval(x1 + 5, y1 + 5, x2 - 5, y2 - 5, state="hidden", tags="piece")
+                    marker = self.canvas.create_text((x1 + x2) // 2, (y1 + y2) // 2, text="K", font=("Arial", 20, "bold"),
+                                                     state="hidden", tags="piece")
+                    self.piece_items[(row, col)] = (oval, marker)
+        # The board as it is currently drawn, to find the squares that changed
+        self.drawn_board = [["" for _ in range(BOARD_SIZE)] for _ in range(BOARD_SIZE)]
+
+    def draw_board(self):
+        # Bring the game board on the canvas up to date with the current position and clear the highlights.
+        # Only the squares whose piece changed since the last call are redrawn.
+        self.clear_highlights()
+        board = self.board
+        drawn_board = self.drawn_board
+        for (row, col), (oval, marker) in self.piece_items.items():
+            piece = board[row][col]
+            if piece == drawn_board[row][col]:
+                continue
+            if piece == "":
+                self.canvas.itemconfig(oval, state="hidden")
+                self.canvas.itemconfig(marker, state="hidden")
+            else:
+                self.canvas.itemconfig(oval, fill=piece, state="normal")
+                if piece in KING_MARKER_COLORS:
+                    self.canvas.itemconfig(marker, fill=KING_MARKER_COLORS[piece], state="normal")
+                else:
+                    self.canvas.itemconfig(marker, state="hidden")
+        self.drawn_board = board
+
+    def clear_highlights(self):
+        # Remove the move and capture highlights, which are kept on their own layer of canvas items tagged "highlight"
+        self.canvas.delete("highlight")
 
     def handle_player_move(self, event):
         # The method is responsible for handling the player's move in the game of checkers.
@@ -85,8 +196,11 @@ class CheckersGame:
 
         col = event.x // SQUARE_SIZE
         row = event.y // SQUARE_SIZE
+        if self.busy:
+            # Ignore clicks while a move is being shown or the AI is thinking
+            return
         if self.selected_piece is None:
-            if self.board[row][col] == PLAYER_COLOR or self.board[row][col] == PLAYER_KING_COLOR:
+            if self.board[row][col] in [PLAYER_COLOR, PLAYER_KING_COLOR]:
                 self.selected_piece = (row, col)
                 self.draw_board()
                 valid_moves, mandatory_captures = self.get_valid_moves(PLAYER_COLOR)
@@ -100,28 +214,8 @@ class CheckersGame:
                 if captures:
                     if move in [capture[:2] for capture in captures]:
                         captured_positions = next(capture[2] for capture in captures if capture[:2] == move)
-                        while True:
-                            self.board = self.make_move(move + (captured_positions,))
-                            self.draw_board()
-                            self.window.update()
-                            time.sleep(1)  # Add a delay of 1 second between each capture move
-
-                            # Check if the piece has become a king by capturing an opponent's king
-                            if self.board[move[1][0]][move[1][1]] == PLAYER_KING_COLOR:
-                                break
-
-                            valid_moves, mandatory_captures = self.get_valid_moves(PLAYER_COLOR)
-                            filtered_captures = [capture for capture in mandatory_captures if capture[0] == move[1]]
-                            if filtered_captures:
-                                move = filtered_captures[0][:2]
-                                captured_positions = filtered_captures[0][2]
-                            else:
-                                break
-                        self.selected_piece = None
-                        if self.is_game_over():
-                            self.show_game_over()
-                        else:
-                            self.window.after(100, self.handle_ai_move)
+                        self.busy = True
+                        self.play_player_capture(move + (captured_positions,), self.game_id)
                     else:
                         messagebox.showwarning("Invalid Move", "You must make a capture move!")
                         self.selected_piece = None
@@ -133,273 +227,333 @@ class CheckersGame:
                     self.draw_board()
                     self.highlight_mandatory_captures(PLAYER_COLOR)
             elif move in valid_moves:
-                self.board = self.make_move(move)
+                self.play_move(move)
                 self.draw_board()
-                self.selected_piece = None
-                if self.is_game_over():
-                    self.show_game_over()
-                else:
-                    self.window.after(100, self.handle_ai_move)
+                self.end_player_move()
             else:
                 self.selected_piece = None
                 self.draw_board()
                 self.highlight_mandatory_captures(PLAYER_COLOR)
 
-    def minimax(self, depth, alpha, beta, maximizing_player, moves):
-        # The method helps determine the best move for a player by evaluating all possible moves and their outcomes, assuming that the opponent plays optimally.
-        # The algorithm recursively explores the game tree, alternating between maximizing the score for the current player and minimizing the score for the opponent.
-
-        if depth == 0 or self.is_game_over():
-            return self.evaluate_board(), None
+    def play_player_capture(self, move, game_id):
+        # Play one jump of the player's capture, then schedule the next jump (the first capture available from the landing square) after a delay of 1 second.
+        # The capture ends when no further jump is available or when the piece has become a king by capturing an opponent's king.
+        if game_id != self.game_id:
+            return
+        self.play_move(move)
+        self.draw_board()
 
-        if maximizing_player:
-            max_eval = float('-inf')
-            best_move = None
-            for move in moves:
-                new_board = self.make_move(move)
+        def next_step():
+            if game_id != self.game_id:
+                return
+            # Check if the piece has become a king by capturing an opponent's king
+            if self.board[move[1][0]][move[1][1]] != PLAYER_KING_COLOR:
                 valid_moves, mandatory_captures = self.get_valid_moves(PLAYER_COLOR)
-                if mandatory_captures:
-                    eval = self.minimax(depth - 1, alpha, beta, False, mandatory_captures)[0]
-                else:
-                    eval = self.minimax(depth - 1, alpha, beta, False, valid_moves)[0]
-                if eval > max_eval:
-                    max_eval = eval
-                    best_move = move
-                alpha = max(alpha, eval)
-                if beta <= alpha:
-                    break
-            return max_eval, best_move
+                filtered_captures = [capture for capture in mandatory_captures if capture[0] == move[1]]
+                if filtered_captures:
+                    self.play_player_capture(filtered_captures[0], game_id)
+                    return
+            self.end_player_move()
+
+        self.window.after(CAPTURE_DELAY_MS, next_step)
+
+    def end_player_move(self):
+        # Finish the player's turn: check if the game is over, otherwise let the AI move.
+        # Clicks stay ignored until the AI has played, including the short delay before its search starts.
+        self.selected_piece = None
+        if self.is_game_over(AI_COLOR):
+            self.busy = False
+            self.show_game_over(AI_COLOR)
         else:
-            min_eval = float('inf')
-            best_move = None
-            for move in moves:
-                new_board = self.make_move(move)
-                valid_moves, mandatory_captures = self.get_valid_moves(AI_COLOR)
-                if mandatory_captures:
-                    eval = self.minimax(depth - 1, alpha, beta, True, mandatory_captures)[0]
-                else:
-                    eval = self.minimax(depth - 1, alpha, beta, True, valid_moves)[0]
-                if eval < min_eval:
-                    min_eval = eval
-                    best_move = move
-                beta = min(beta, eval)
-                if beta <= alpha:
-                    break
-            return min_eval, best_move
+            self.busy = True
+            self.window.after(100, self.handle_ai_move, self.game_id)
+
+    def minimax(self, depth, alpha, beta, maximizing_player, moves):
+        # The method helps determine the best move for a player by evaluating all possible moves and their outcomes, assuming that the opponent plays optimally.
+        # The search itself is run by a Searcher on a copy of the current position, playing and taking back moves in place so that every node is the real child position.
+        # The moves argument is the list of candidate moves for the side to move, in the tuple shape returned by get_valid_moves.
+        # Returns the score of the best move (from the AI's point of view) and the best move itself.
+        # The statistics of the search, including the transposition table hit rate, are kept in last_search_stats.
+
+        position = self.position.copy()
+        position.set_turn(AI_COLOR if maximizing_player else PLAYER_COLOR)
+        self.transposition_table.new_search()
+        searcher = Searcher(position, self.transposition_table, tablebase=self.tablebase)
+        score, best_move = searcher.minimax(depth, alpha, beta, maximizing_player, [move_from_legacy(move) for move in moves])
+        self.last_search_stats = searcher.stats
+        return score, move_to_legacy(best_move) if best_move is not None else None
+
+    def create_ai_searcher(self, stop_event=None):
+        # Create the searcher for the AI's move, on a copy of the current position with the AI to move.
+        # When AI_WORKERS is more than one, the root moves are searched in parallel by a pool of worker processes.
+        position = self.position.copy()
+        position.set_turn(AI_COLOR)
+        if AI_WORKERS > 1:
+            if self.search_pool is None or self.search_pool_workers != AI_WORKERS:
+                if self.search_pool is not None:
+                    self.search_pool.shutdown(wait=False, cancel_futures=True)
+                self.search_pool = create_pool(AI_WORKERS, tablebase_path=TABLEBASE_PATH if self.tablebase is not None else None)
+                self.search_pool_workers = AI_WORKERS
+            return ParallelSearcher(position, self.search_pool, self.transposition_table, stop_event=stop_event, tablebase=self.tablebase)
+        return Searcher(position, self.transposition_table, stop_event=stop_event, tablebase=self.tablebase)
+
+    def search_ai_move(self):
+        # Search for the AI's move with iterative deepening. The search goes at most AI_DEPTH moves deep and stops after AI_TIME_MS milliseconds,
+        # returning the best move of the deepest search that completed, in the tuple shape returned by get_valid_moves.
+        # This runs the search on the calling thread; the game itself uses handle_ai_move, which searches in the background.
+        # In the opening, a move from the opening book is returned without searching.
+        book_move = self.get_book_move()
+        if book_move is not None:
+            return book_move
+        searcher = self.create_ai_searcher()
+        best_move = searcher.search(AI_DEPTH, AI_TIME_MS)[1]
+        self.last_search_stats = searcher.stats
+        return move_to_legacy(best_move) if best_move is not None else None
+
+    def get_book_move(self):
+        # Return the opening book move of the AI in the current position, in the tuple shape returned by get_valid_moves,
+        # or None when there is no opening book or the position is not in it
+        if self.opening_book is None:
+            return None
+        position = self.position.copy()
+        position.set_turn(AI_COLOR)
+        move = self.opening_book.choose(position, BOOK_VARIETY)
+        return move_to_legacy(move) if move is not None else None
 
     def evaluate_board(self):
         # The method is used to assess the current state of the game board and assign a numeric score to it.
         # It takes into account various factors, such as the number of remaining pieces for each player, the number of king pieces, and potentially other strategic considerations.
-        # The score is calculated based on the difference between the AI player's pieces and the human player's pieces, as well as a weighted value for the king pieces.
+        # The score is calculated based on the difference between the AI player's pieces and the human player's pieces, as well as a weighted value for the king pieces
+        # and small bonuses for advanced men, men guarding the back row and pieces in the center. The position keeps all of these as running counters, so no board scan is needed.
+        # The weights of these features, and of the optional mobility and tempo features, can be fitted to game results with tuner.py (see bitboard.FEATURE_NAMES).
         # This evaluation helps the Minimax algorithm determine the desirability of a particular board configuration and guides the decision-making process for the AI player.
         # The higher the score, the more favourable the board state is considered for the AI player.
 
-        player_pieces = sum(row.count(PLAYER_COLOR) + row.count(PLAYER_KING_COLOR) for row in self.board)
-        ai_pieces = sum(row.count(AI_COLOR) + row.count(AI_KING_COLOR) for row in self.board)
-        player_kings = sum(row.count(PLAYER_KING_COLOR) for row in self.board)
-        ai_kings = sum(row.count(AI_KING_COLOR) for row in self.board)
+        return self.position.evaluate()
 
-        # Calculate the score based on piece count and king count
-        score = (ai_pieces - player_pieces) + (ai_kings * 0.5 - player_kings * 0.5)
-        return score
-
-    def handle_ai_move(self):
+    def handle_ai_move(self, game_id=None):
         # The method is responsible for handling the AI's moves in the game of checkers. It is called after the player's move is completed.
-        # The method first checks if the game is over. If not, it retrieves the valid moves and mandatory captures for the AI player.
-        # If there are mandatory captures available, it randomly selects one of them and performs the capture move.
-        # If there are no mandatory captures, it randomly selects a valid move.
-        # The method also handles the case when the AI captures an opponent's king, promoting its own piece to a king.
-        # After the AI's move is completed, it updates the game board, adds a delay for visual effect, and checks if the game is over.
-        # If the game is over, it calls the show_game_over method to display the result.
-
-        if not self.is_game_over():
-            valid_moves, mandatory_captures = self.get_valid_moves(AI_COLOR)
-            if mandatory_captures:
-                ai_move = self.minimax(AI_DEPTH, float('-inf'), float('inf'), True, mandatory_captures)[1]
-                captured_positions = ai_move[2]
-                while True:
-                    self.board = self.make_move(ai_move)
-                    self.draw_board()
-                    self.window.update()
-                    time.sleep(1)  # Add a delay of 1 second between each capture move
-
-                    # Check if the piece has become a king by capturing an opponent's king
-                    if self.board[ai_move[1][0]][ai_move[1][1]] == AI_KING_COLOR:
-                        break
-
-                    valid_moves, mandatory_captures = self.get_valid_moves(AI_COLOR)
-                    filtered_captures = [capture for capture in mandatory_captures if capture[0] == ai_move[1]]
-                    if filtered_captures:
-                        ai_move = self.minimax(AI_DEPTH, float('-inf'), float('inf'), True, filtered_captures)[1]
-                        captured_positions = ai_move[2]
-                    else:
-                        break
+        # The method first checks if the game is over. If not, it starts the Minimax search for the AI's move on a background thread, so that the window stays responsive while the AI thinks.
+        # The search can be cut short with the "Move now" button, in which case the AI plays the best move found so far.
+        # The result is picked up on the Tk event loop by poll_ai_move.
+        # In the opening, the AI plays a move from the opening book straight away.
+        # If the AI was pondering and had already searched the position as deep as AI_DEPTH, it plays the move found while pondering straight away.
+        # A call scheduled with the game_id of an earlier game does nothing.
+
+        if game_id is not None and game_id != self.game_id:
+            return
+        pondered = self.stop_pondering()
+        if self.is_game_over(AI_COLOR):
+            self.show_game_over(AI_COLOR)
+            return
+        self.busy = True
+        book_move = self.get_book_move()
+        if book_move is not None:
+            self.last_search_stats = None
+            self.play_ai_steps(self.get_move_steps(book_move), self.game_id)
+            return
+        if pondered is not None and pondered[0] >= AI_DEPTH and pondered[2] is not None:
+            self.last_search_stats = pondered[3]
+            self.play_ai_steps(self.get_move_steps(move_to_legacy(pondered[2])), self.game_id)
+            return
+        self.ai_stop_event = threading.Event()
+        searcher = self.create_ai_searcher(self.ai_stop_event)
+        self.ai_result = None
+        self.ai_error = None
+        self.ai_thread = threading.Thread(target=self.run_ai_search, args=(searcher,), daemon=True)
+        self.ai_thread.start()
+        self.window.after(AI_POLL_MS, self.poll_ai_move, self.ai_thread, self.game_id)
+
+    def run_ai_search(self, searcher):
+        # Runs on the background thread: search for the AI's move and leave the result, or the exception if the search failed, for poll_ai_move
+        try:
+            if self.search_tracer is not None:
+                best_move = self.search_tracer.run(searcher, AI_DEPTH, AI_TIME_MS)[1]
             else:
-                ai_move = self.minimax(AI_DEPTH, float('-inf'), float('inf'), True, valid_moves)[1]
-                if ai_move is not None:
-                    self.board = self.make_move(ai_move)
-                    self.draw_board()
-                    self.window.update()
-                    time.sleep(1)  # Add a delay of 1 second for AI's move
-            if self.is_game_over():
-                self.show_game_over()
+                best_move = searcher.search(AI_DEPTH, AI_TIME_MS)[1]
+        except Exception as error:
+            self.ai_error = error
+            return
+        self.ai_result = (searcher.stats, move_to_legacy(best_move) if best_move is not None else None)
+
+    def poll_ai_move(self, thread, game_id):
+        # Check, from the Tk event loop, whether the background search has finished, and play its move when it has.
+        # Results of searches that were started before the game was restarted are thrown away.
+        if game_id != self.game_id:
+            return
+        if thread.is_alive():
+            self.window.after(AI_POLL_MS, self.poll_ai_move, thread, game_id)
+            return
+        self.ai_thread = None
+        if self.ai_result is None:
+            # The board stays locked: the AI is to move, so the player cannot go on until the game is restarted
+            messagebox.showerror("AI error", "The AI could not choose a move: %s\nRestart the game or load a position to go on."
+                                 % (self.ai_error or "the search ended without a result"))
+            return
+        self.last_search_stats, ai_move = self.ai_result
+        steps = self.get_move_steps(ai_move) if ai_move is not None else []
+        self.play_ai_steps(steps, game_id)
+
+    def play_ai_steps(self, steps, game_id):
+        # Play the AI's move one jump at a time, with a delay of 1 second after each step for visual effect.
+        # The AI's piece is promoted to a king when it captures an opponent's king. After the last step, it checks if the game is over.
+        if game_id != self.game_id:
+            return
+        if not steps:
+            self.busy = False
+            self.update_info_panel()
+            if self.is_game_over(PLAYER_COLOR):
+                self.show_game_over(PLAYER_COLOR)
+            else:
+                self.start_pondering()
+            return
+        self.play_move(steps[0])
+        self.draw_board()
+        self.window.after(CAPTURE_DELAY_MS, self.play_ai_steps, steps[1:], game_id)
+
+    def start_pondering(self):
+        # Start searching ahead on the player's time, if pondering is turned on
+        if not self.ponder_var.get() or self.ponderer is not None:
+            return
+        position = self.position.copy()
+        position.set_turn(PLAYER_COLOR)
+        self.ponderer = Ponderer(position, self.transposition_table, AI_DEPTH, tablebase=self.tablebase)
+        self.ponderer.start()
+
+    def stop_pondering(self):
+        # Stop pondering and update the ponder statistics.
+        # Returns the pondering result (depth, score, best_move, stats) for the current position when it was one of the predicted ones, otherwise None.
+        if self.ponderer is None:
+            return None
+        self.ponderer.stop()
+        position = self.position.copy()
+        position.set_turn(AI_COLOR)
+        pondered = self.ponderer.lookup(position)
+        self.ponderer = None
+        self.ponder_moves += 1
+        if pondered is not None:
+            self.ponder_hits += 1
+        return pondered
+
+    def update_pondering(self):
+        # Called when the pondering checkbox changes
+        if self.ponder_var.get():
+            # When nothing else is going on it is the player's turn
+            if not self.busy and not self.is_game_over(PLAYER_COLOR):
+                self.start_pondering()
+        elif self.ponderer is not None:
+            self.ponderer.stop()
+            self.ponderer = None
+
+    def update_info_panel(self):
+        # Show or hide the search info panel, and fill it in with the statistics of the AI's last search
+        if not self.info_var.get():
+            self.info_label.pack_forget()
+            return
+        self.info_label.config(text=self.format_search_info(self.last_search_stats))
+        self.info_label.pack()
+
+    def format_search_info(self, stats):
+        # Describe the statistics of a search in a few lines of text for the info panel
+        if stats is None:
+            return "No search for the last move\n(opening book or no move yet)"
+        return "\n".join([
+            ("Pondered  " if stats.pondered else "") + "Depth %d  Nodes %d  %.0f ms  %.0f nodes/s" % (
+                stats.depth, stats.nodes, stats.elapsed_ms, stats.nodes_per_second()),
+            "Branching %.2f (effective %.2f)  Cutoffs %.0f%%  First move %.0f%%" % (
+                stats.branching_factor(), stats.effective_branching_factor(), stats.cutoff_rate() * 100, stats.first_move_cutoff_rate() * 100),
+            "Table hits %.0f%%  Quiescence nodes %d  Tablebase hits %d" % (stats.tt_hit_rate() * 100, stats.quiescence_nodes, stats.tablebase_hits),
+            "Ponder hits %.0f%%  Move cache hits %.0f%%" % (self.ponder_hit_rate() * 100, self.move_cache.hit_rate() * 100),
+        ])
+
+    def ponder_hit_rate(self):
+        # Fraction of the player's moves made while pondering that the AI had predicted
+        return self.ponder_hits / self.ponder_moves if self.ponder_moves else 0.0
+
+    def stop_ai_search(self):
+        # Tell the AI to stop thinking and play the best move it has found so far
+        if self.ai_stop_event is not None:
+            self.ai_stop_event.set()
 
     def get_valid_moves(self, player_color):
         # The method is responsible for retrieving all the valid moves and mandatory captures for a given player (either the human player or the AI player) in the game of checkers.
-        # It iterates over each square on the game board and checks if the square contains a piece belonging to the specified player.
-        # For each piece, it calls the get_valid_captures and get_valid_moves_for_piece methods to determine the valid capture moves and regular moves, respectively.
+        # The moves are generated by the bitboard Position for all of the player's pieces at once and converted to the tuple shape used by the rest of the game.
         # The method returns two lists: one containing all the valid regular moves and another containing all the mandatory capture moves.
+        # The capture list includes every intermediate step of a multi-step capture so that the player can make one jump per click.
         # This information is used by other methods to highlight the available moves for the player and to validate the player's move.
 
-        valid_moves = []
-        mandatory_captures = []
-        for row in range(BOARD_SIZE):
-            for col in range(BOARD_SIZE):
-                if self.board[row][col] == player_color or self.board[row][col] == self.get_king_color(player_color):
-                    captures = self.get_valid_captures(row, col)
-                    if captures:
-                        mandatory_captures.extend(captures)
-                    moves = self.get_valid_moves_for_piece(row, col)
-                    valid_moves.extend(moves)
-
-        return valid_moves, mandatory_captures
+        quiet_moves, partial_captures = self.move_cache.get_moves(self.position, player_color)
+        captures = [move_to_legacy(move) for move in partial_captures]
+        valid_moves = [move_to_legacy(move) for move in quiet_moves] + captures
+        return valid_moves, captures
 
     def get_valid_moves_for_piece(self, row, col):
         # The method is responsible for retrieving the valid regular moves for a specific piece on the game board.
         # It takes the row and column coordinates of the piece as input.
-        # The method first determines the color of the piece and whether it is a regular piece or a king.
-        # Based on the piece color, it defines the possible move directions. For a regular piece, it can move diagonally forward, while a king piece can move diagonally both forward and backward.
-        # The method then checks each possible move direction and adds the move to the list of valid moves if the destination square is empty and within the bounds of the game board.
-        # Additionally, it calls the get_valid_captures method to retrieve any valid capture moves for the piece and appends them to the list of valid moves.
+        # Men move diagonally forward and kings move diagonally both forward and backward, to an adjacent empty square.
+        # The capture moves of the piece, as returned by get_valid_captures, are appended to the list of valid moves.
         # The method returns the complete list of valid moves for the given piece.
 
-        valid_moves = []
         piece_color = self.board[row][col]
-        is_king = piece_color in [PLAYER_KING_COLOR, AI_KING_COLOR]
-
-        # Regular piece movement
-        if piece_color == PLAYER_COLOR:
-            directions = [(-1, -1), (-1, 1)]
-        else:
-            directions = [(1, -1), (1, 1)]
-
-        for d_row, d_col in directions:
-            new_row, new_col = row + d_row, col + d_col
-            if self.is_valid_position(new_row, new_col) and self.board[new_row][new_col] == "":
-                valid_moves.append(((row, col), (new_row, new_col)))
-
-        # King piece movement
-        if is_king:
-            directions = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
-            for d_row, d_col in directions:
-                new_row, new_col = row + d_row, col + d_col
-                if self.is_valid_position(new_row, new_col) and self.board[new_row][new_col] == "":
-                    valid_moves.append(((row, col), (new_row, new_col)))
-
-        # Capture moves
-        captures = self.get_valid_captures(row, col)
-        valid_moves.extend(captures)
-
+        if piece_color == "":
+            return []
+        color = PLAYER_COLOR if piece_color in [PLAYER_COLOR, PLAYER_KING_COLOR] else AI_COLOR
+        square = row_col_to_square(row, col)
+        valid_moves = [move_to_legacy(move) for move in self.move_cache.get_moves(self.position, color)[0] if move & MOVE_SQUARE_MASK == square]
+        valid_moves.extend(self.get_valid_captures(row, col))
         return valid_moves
 
     def get_valid_captures(self, row, col):
         # The method is responsible for retrieving the valid capture moves for a specific piece on the game board.
         # It takes the row and column coordinates of the piece as input.
-        # The method first determines the color of the piece, whether it is a regular piece or a king, and the color of the opponent's pieces.
-        # Based on the piece's color and type, it defines the possible capture directions.
-        # It then checks each possible capture direction to see if there is an opponent's piece in the adjacent square and an empty square beyond it.
-        # If a valid capture is found, it adds the capture move to the list of captures and recursively calls the get_valid_captures_for_board method to check for multi-step captures.
-        # The recursive call is made on a copy of the game board, with the piece moved to the captured position.
-        # The method returns the complete list of valid capture moves for the given piece, including any multi-step captures.
-
-        captures = []
-        piece_color = self.board[row][col]
-        is_king = piece_color in [PLAYER_KING_COLOR, AI_KING_COLOR]
-        opponent_piece, opponent_king = (
-            AI_COLOR, AI_KING_COLOR) if piece_color in [PLAYER_COLOR, PLAYER_KING_COLOR] else (
-            PLAYER_COLOR, PLAYER_KING_COLOR)
-
-        directions = [(-1, -1), (-1, 1), (1, -1), (1, 1)] if is_king else [(-1, -1), (-1, 1)] if piece_color == PLAYER_COLOR else [(1, -1), (1, 1)]
-
-        for d_row, d_col in directions:
-            new_row, new_col = row + d_row, col + d_col
-            if self.is_valid_position(new_row, new_col) and self.board[new_row][new_col] in [opponent_piece, opponent_king]:
-                jump_row, jump_col = new_row + d_row, new_col + d_col
-                if self.is_valid_position(jump_row, jump_col) and self.board[jump_row][jump_col] == "":
-                    captured_positions = [(new_row, new_col)]
-                    captures.append(((row, col), (jump_row, jump_col), captured_positions))
-                    # Check for multi-step captures
-                    board_copy = [row[:] for row in self.board]
-                    board_copy[jump_row][jump_col] = piece_color
-                    board_copy[new_row][new_col] = ""
-                    board_copy[row][col] = ""
-                    further_captures = self.get_valid_captures_for_board(board_copy, jump_row, jump_col)
-                    for capture in further_captures:
-                        captures.append(((row, col), capture[1], captured_positions + capture[2]))
-
-        return captures
+        # The method returns the complete list of valid capture moves for the given piece, including every step of any multi-step captures.
+
+        return self.get_valid_captures_for_position(self.position, row, col)
 
     def get_valid_captures_for_board(self, board, row, col):
-        # The method is a helper method used by the get_valid_captures method to retrieve the valid capture moves for a specific piece on a given game board configuration.
-        # It takes the game board, row, and column coordinates of the piece as input.
-        # The purpose of this method is to handle multi-step captures. When a piece makes a capture move, the method recursively calls itself on the updated game board to check if further captures are possible from the new position.
-        # It follows the same logic as the get_valid_captures method to determine the possible capture directions and validate the captures.
-        # The method returns the list of valid capture moves for the piece on the given game board configuration, allowing the get_valid_captures method to construct the complete list of capture moves, including multi-step captures.
-
-        captures = []
-        piece_color = board[row][col]
-        is_king = piece_color in [PLAYER_KING_COLOR, AI_KING_COLOR]
-        opponent_piece, opponent_king = (
-            AI_COLOR, AI_KING_COLOR) if piece_color in [PLAYER_COLOR, PLAYER_KING_COLOR] else (
-            PLAYER_COLOR, PLAYER_KING_COLOR)
-
-        directions = [(-1, -1), (-1, 1), (1, -1), (1, 1)] if is_king else [(-1, -1), (-1, 1)] if piece_color == PLAYER_COLOR else [(1, -1), (1, 1)]
-
-        for d_row, d_col in directions:
-            new_row, new_col = row + d_row, col + d_col
-            if self.is_valid_position(new_row, new_col) and board[new_row][new_col] in [opponent_piece, opponent_king]:
-                jump_row, jump_col = new_row + d_row, new_col + d_col
-                if self.is_valid_position(jump_row, jump_col) and board[jump_row][jump_col] == "":
-                    captured_positions = [(new_row, new_col)]
-                    captures.append(((row, col), (jump_row, jump_col), captured_positions))
-                    # Check for multi-step captures
-                    board_copy = [row[:] for row in board]
-                    board_copy[jump_row][jump_col] = piece_color
-                    board_copy[new_row][new_col] = ""
-                    board_copy[row][col] = ""
-                    further_captures = self.get_valid_captures_for_board(board_copy, jump_row, jump_col)
-                    for capture in further_captures:
-                        captures.append(((row, col), capture[1], captured_positions + capture[2]))
-
-        return captures
+        # The method retrieves the valid capture moves for a specific piece on a given game board configuration.
+        # It takes the game board, row, and column coordinates of the piece as input, and follows the same logic as the get_valid_captures method.
+
+        return self.get_valid_captures_for_position(Position.from_board(board), row, col)
+
+    def get_valid_captures_for_position(self, position, row, col):
+        # Helper for get_valid_captures and get_valid_captures_for_board that runs the bitboard capture generator for a single piece
+        square = row_col_to_square(row, col)
+        if square is None:
+            return []
+        piece_color = position.piece_at(square)
+        if piece_color == "":
+            return []
+        color = PLAYER_COLOR if piece_color in [PLAYER_COLOR, PLAYER_KING_COLOR] else AI_COLOR
+        return [move_to_legacy(move) for move in self.move_cache.get_moves(position, color)[1] if move & MOVE_SQUARE_MASK == square]
 
     def make_move(self, move):
-        # The method is responsible for executing a move on the game board. It takes a move tuple as input, which contains the starting position, ending position, and any captured positions.
-        # The method first retrieves the necessary information from the move tuple, such as the starting row and column, ending row and column, and the color of the piece being moved.
-        # It then creates a new game board by making a copy of the current board.
-        # The method updates the new board by moving the piece from the starting position to the ending position and removing any captured pieces from the board.
-        # Additionally, it checks if the moved piece should be promoted to a king based on its ending position or if it captured an opponent's king.
+        # The method is responsible for computing the result of a move without changing the game. It takes a move tuple as input, which contains the starting position, ending position, and any captured positions.
+        # The move is played on a copy of the current position with Position.apply, which moves the piece, removes any captured pieces and promotes the piece to a king if it reaches the far row or captures an opponent's king.
         # The method returns the updated game board after the move has been executed.
 
-        start_row, start_col = move[0]
-        end_row, end_col = move[1]
-        captured_positions = move[2] if len(move) > 2 else []
-        piece_color = self.board[start_row][start_col]
-        new_board = [row[:] for row in self.board]
-        new_board[end_row][end_col] = piece_color
-        new_board[start_row][start_col] = ""
-
-        # Check for king conversion
-        if piece_color == PLAYER_COLOR and (end_row == 0 or any(self.board[pos[0]][pos[1]] == AI_KING_COLOR for pos in captured_positions)):
-            new_board[end_row][end_col] = PLAYER_KING_COLOR
-        elif piece_color == AI_COLOR and (end_row == BOARD_SIZE - 1 or any(self.board[pos[0]][pos[1]] == PLAYER_KING_COLOR for pos in captured_positions)):
-            new_board[end_row][end_col] = AI_KING_COLOR
-
-        # Remove captured pieces
-        for captured_row, captured_col in captured_positions:
-            new_board[captured_row][captured_col] = ""
-
-        return new_board
+        position = self.position.copy()
+        position.apply(move_from_legacy(move))
+        return position.to_board()
+
+    def play_move(self, move):
+        # Play a move, in the tuple shape returned by get_valid_moves, on the current position in place
+        self.position.apply(move_from_legacy(move))
+
+    def get_move_steps(self, move):
+        # Split a move into the single jumps that make it up, so that a multi-step capture can be shown one jump at a time.
+        # Quiet moves and single captures are returned as a list with just the move itself.
+        if len(move) < 3 or len(move[2]) < 2:
+            return [move]
+        path = self.position.get_capture_path(move_from_legacy(move))
+        steps = []
+        start = move[0]
+        for landing in path:
+            end = square_to_row_col(landing)
+            captured = ((start[0] + end[0]) // 2, (start[1] + end[1]) // 2)
+            steps.append((start, end, [captured]))
+            start = end
+        return steps
 
     def is_valid_position(self, row, col):
         # The method is a simple helper method that checks if a given position, specified by row and column coordinates, is valid on the game board.
@@ -434,7 +588,7 @@ class CheckersGame:
             y1 = end_row * SQUARE_SIZE
             x2 = x1 + SQUARE_SIZE
             y2 = y1 + SQUARE_SIZE
-            self.canvas.create_rectangle(x1, y1, x2, y2, fill="yellow", stipple="gray50")
+            self.canvas.create_rectangle(x1, y1, x2, y2, fill="yellow", stipple="gray50", tags="highlight")
 
     def highlight_mandatory_captures(self, player_color):
         # The method is responsible for visually highlighting the pieces on the game board that have mandatory capture moves available.
@@ -451,66 +605,91 @@ class CheckersGame:
             y1 = start_row * SQUARE_SIZE
             x2 = x1 + SQUARE_SIZE
             y2 = y1 + SQUARE_SIZE
-            self.canvas.create_rectangle(x1, y1, x2, y2, outline="yellow", width=4)
+            self.canvas.create_rectangle(x1, y1, x2, y2, outline="yellow", width=4, tags="highlight")
 
-    def is_game_over(self):
-        # Check if the game is over
-        player_pieces = sum(row.count(PLAYER_COLOR) + row.count(PLAYER_KING_COLOR) for row in self.board)
-        ai_pieces = sum(row.count(AI_COLOR) + row.count(AI_KING_COLOR) for row in self.board)
-        game_over = False
-        if player_pieces == 0 or ai_pieces == 0:
-            game_over = True
+    def is_game_over(self, color):
+        # Check if the game is over with the given side to move: either side has no pieces left, or the side to move has no valid moves
+        return self.position.is_game_over(color)
 
-        return game_over
-
-    def show_game_over(self):
-        # Show the game over message
-        player_pieces = sum(row.count(PLAYER_COLOR) + row.count(PLAYER_KING_COLOR) for row in self.board)
-        ai_pieces = sum(row.count(AI_COLOR) + row.count(AI_KING_COLOR) for row in self.board)
-
-        if player_pieces == 0:
+    def show_game_over(self, color):
+        # Show the game over message. color is the side that was to move when the game ended.
+        if self.position.loser(color) == PLAYER_COLOR:
             result = "You lost!"
-        elif ai_pieces == 0:
-            result = "You won!"
         else:
-            player_moves = self.get_valid_moves(PLAYER_COLOR)
-            if player_pieces > 0 and len(player_moves[0]) == 0 and len(player_moves[1]) == 0:
-                result = "You lost!"
-            else:
-                result = "You won!"
+            result = "You won!"
 
-        self.canvas.delete("all")
-        self.canvas.create_text(BOARD_SIZE * SQUARE_SIZE // 2, BOARD_SIZE * SQUARE_SIZE // 2, text=result,
-                                font=("Arial", 32), fill="blue")
-        self.window.after(2000, self.restart_game)
+        # The message is drawn over the board on its own "message" layer, which restart_game removes
+        self.clear_highlights()
+        center = BOARD_SIZE * SQUARE_SIZE // 2
+        self.canvas.create_rectangle(center - 120, center - 40, center + 120, center + 40, fill="white", outline="blue", width=3, tags="message")
+        self.canvas.create_text(center, center, text=result, font=("Arial", 32), fill="blue", tags="message")
+        game_id = self.game_id
+        self.window.after(2000, lambda: self.restart_game() if game_id == self.game_id else None)
 
     def update_ai_depth(self, *args):
-        # Update AI depth based on selected difficulty level
-        global AI_DEPTH
+        # Update the AI's maximum depth, time per move and number of search processes based on selected difficulty level
+        global AI_DEPTH, AI_TIME_MS, AI_WORKERS
         selected_difficulty = self.difficulty_var.get()
         if selected_difficulty == "Easy":
-            AI_DEPTH = 3
+            AI_DEPTH, AI_TIME_MS, AI_WORKERS = 3, 250, 1
         elif selected_difficulty == "Medium":
-            AI_DEPTH = 5
+            AI_DEPTH, AI_TIME_MS, AI_WORKERS = 5, 500, 1
         elif selected_difficulty == "Hard":
-            AI_DEPTH = 7
+            AI_DEPTH, AI_TIME_MS, AI_WORKERS = 7, 1000, 1
         elif selected_difficulty == "Very Hard":
-            AI_DEPTH = 10
+            AI_DEPTH, AI_TIME_MS, AI_WORKERS = 10, 2000, default_worker_count()
         self.restart_game()
 
-    def restart_game(self):
-        # Restart the game
-        self.board = [
-            ["", AI_COLOR, "", AI_COLOR, "", AI_COLOR, "", AI_COLOR],
-            [AI_COLOR, "", AI_COLOR, "", AI_COLOR, "", AI_COLOR, ""],
-            ["", AI_COLOR, "", AI_COLOR, "", AI_COLOR, "", AI_COLOR],
-            ["", "", "", "", "", "", "", ""],
-            ["", "", "", "", "", "", "", ""],
-            [PLAYER_COLOR, "", PLAYER_COLOR, "", PLAYER_COLOR, "", PLAYER_COLOR, ""],
-            ["", PLAYER_COLOR, "", PLAYER_COLOR, "", PLAYER_COLOR, "", PLAYER_COLOR],
-            [PLAYER_COLOR, "", PLAYER_COLOR, "", PLAYER_COLOR, "", PLAYER_COLOR, ""]
-        ]
+    def restart_game(self, position=None):
+        # Restart the game, stopping any search still running for the previous game.
+        # The new game starts from position when one is given, otherwise from the initial position; when the AI is to move there, it moves straight away.
+        if self.ponderer is not None:
+            self.ponderer.stop()
+            self.ponderer = None
+        if self.ai_stop_event is not None:
+            self.ai_stop_event.set()
+        if self.ai_thread is not None:
+            self.ai_thread.join()
+            self.ai_thread = None
+        self.game_id += 1
+        self.busy = False
+        self.selected_piece = None
+        self.position = position if position is not None else Position.initial()
+        self.transposition_table.clear()
+        self.canvas.delete("message")
         self.draw_board()
+        if self.is_game_over(self.position.turn):
+            self.show_game_over(self.position.turn)
+        elif self.position.turn == AI_COLOR:
+            self.handle_ai_move()
+
+    def load_position(self):
+        # Ask for a FEN file and start a new game from the position on its first line
+        path = filedialog.askopenfilename(parent=self.window, title="Load position", filetypes=POSITION_FILE_TYPES)
+        if not path:
+            return
+        try:
+            with open(path) as f:
+                position = parse_fen(next((line for line in f if line.strip()), ""))
+        except (OSError, ValueError) as error:
+            messagebox.showerror("Load position", str(error))
+            return
+        self.restart_game(position)
+
+    def save_position(self):
+        # Ask for a file name and write the current position to it in FEN notation.
+        # While a move is being shown the board is between two positions, so saving waits until the move is over.
+        if self.busy and self.ai_thread is None:
+            messagebox.showinfo("Save position", "Wait until the move has been played.")
+            return
+        path = filedialog.asksaveasfilename(parent=self.window, title="Save position", defaultextension=".fen", filetypes=POSITION_FILE_TYPES)
+        if not path:
+            return
+        try:
+            with open(path, "w") as f:
+                f.write(format_fen(self.position) + "\n")
+        except OSError as error:
+            messagebox.showerror("Save position", str(error))
 
     def show_rules(self):
         # Show rules in a popup window
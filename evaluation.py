@@ -0,0 +1,91 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from bitboard import (FEATURE_NAMES, SQUARE_FEATURE_NAMES, SQUARE_FEATURE_COUNTS, FEATURE_SCALE, EVALUATION_WEIGHTS, SHIFTS, SQUARES,
+                      FULL_MASK, KING_DIRECTIONS, BLACK_DIRECTIONS, WHITE_DIRECTIONS, WHITE_MAN_INDEX, WHITE)
+
+# Batch evaluation: the features of Position.feature_values and the evaluation of Position.evaluate, computed with NumPy for many positions at once.
+# Positions are passed as an integer array with one row per position: the black men, black kings, white men and white kings masks,
+# and 1 when white is to move or 0 when black is (see position_states). The square features of all positions come out of a single matrix product
+# of the positions' piece bits with the per-square feature counts, and mobility from mask shifts applied to whole columns.
+# NumPy is only needed for this module and the tuner; the game and the search do not use it.
+
+
+def require_numpy():
+    if np is None:
+        raise ImportError("the batch evaluation needs NumPy (pip install numpy)")
+
+
+def position_states(positions):
+    # Pack Position objects into the integer array used by the batch functions
+    require_numpy()
+    return np.array([(position.black_men, position.black_kings, position.white_men, position.white_kings, position.turn == WHITE)
+                     for position in positions], dtype=np.int64).reshape(-1, 5)
+
+
+def _square_feature_matrix():
+    # The (4 * SQUARES, number of square features) matrix that turns the piece bits of a position (piece type major, then square)
+    # into its square feature values, with black's counts negated so that the product is white's less black's
+    matrix = np.zeros((4 * SQUARES, len(SQUARE_FEATURE_NAMES)), dtype=np.int64)
+    for column, name in enumerate(SQUARE_FEATURE_NAMES):
+        for index in range(4):
+            sign = 1 if index >= WHITE_MAN_INDEX else -1
+            matrix[index * SQUARES:(index + 1) * SQUARES, column] = [sign * count for count in SQUARE_FEATURE_COUNTS[name][index]]
+    return matrix
+
+
+def _popcount(masks):
+    # Number of set bits of every 32-bit mask of an array
+    bytes_ = masks.astype("<u4").view(np.uint8).reshape(-1, 4)
+    return _POPCOUNT8[bytes_].sum(axis=1)
+
+
+def _shift(masks, direction):
+    # Array version of Position._shift: move every bit of every mask one diagonal step in the given direction
+    result = np.zeros_like(masks)
+    for delta, group in SHIFTS[direction]:
+        bits = masks & group
+        result |= (bits << delta) if delta > 0 else (bits >> -delta)
+    return result & FULL_MASK
+
+
+def _mobility(men, kings, empty, forward):
+    # Array version of Position.mobility
+    count = np.zeros(len(men), dtype=np.int64)
+    for direction in KING_DIRECTIONS:
+        movers = (men | kings) if direction in forward else kings
+        count += _popcount(_shift(movers, direction) & empty)
+    return count
+
+
+if np is not None:
+    _POPCOUNT8 = np.array([bin(value).count("1") for value in range(256)], dtype=np.int64)
+    _SQUARE_FEATURES = _square_feature_matrix()
+    _SQUARE_BITS = np.arange(SQUARES, dtype=np.int64)
+
+
+def feature_matrix(states):
+    # Return the float array of the feature values (columns in FEATURE_NAMES order, white's less black's, unweighted) of every position of states
+    require_numpy()
+    states = np.asarray(states, dtype=np.int64).reshape(-1, 5)
+    black_men, black_kings, white_men, white_kings, white_to_move = states.T
+    bits = ((states[:, :4, None] >> _SQUARE_BITS) & 1).reshape(len(states), 4 * SQUARES)
+    square_features = bits @ _SQUARE_FEATURES
+    empty = ~(black_men | black_kings | white_men | white_kings) & FULL_MASK
+    mobility = _mobility(white_men, white_kings, empty, WHITE_DIRECTIONS) - _mobility(black_men, black_kings, empty, BLACK_DIRECTIONS)
+    tempo = np.where(white_to_move != 0, 1, -1)
+    return np.column_stack([square_features, mobility, tempo]).astype(np.float64)
+
+
+def weight_vector(weights=None):
+    # The weights (by default the ones in use) as an array in FEATURE_NAMES order
+    require_numpy()
+    weights = EVALUATION_WEIGHTS if weights is None else weights
+    return np.array([weights[name] for name in FEATURE_NAMES], dtype=np.float64)
+
+
+def evaluate_batch(states, weights=None):
+    # Score every position of states from white's point of view, in men, as Position.evaluate does
+    return feature_matrix(states) @ weight_vector(weights) / FEATURE_SCALE
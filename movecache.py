@@ -0,0 +1,42 @@
+# Default number of move lists kept
+DEFAULT_MAX_ENTRIES = 50000
+
+
+class MoveCache:
+    # The MoveCache class keeps the moves generated for recently seen positions, so that a position seen again does not have its moves generated again:
+    # the user interface asks for the moves of the same position on every click, to highlight them and to check the player's move.
+    # Entries are keyed by the Zobrist hash of the position, which covers the pieces and the side to move, and the color whose moves were generated,
+    # so a changed board has a different key and a stale list is never returned; the least recently used entries are dropped once the cache is full.
+    # Move lists are stored as tuples so that no caller can change a cached list.
+    # The search does not use the cache: most of the positions it visits are met only once, and copying a cached list costs about as much as
+    # generating it into the search's own per-ply lists. The cache is not thread-safe; the game only uses it from the Tk event loop.
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        # Entries in least to most recently used order: a hit takes its entry out and puts it back at the end
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self.entries.clear()
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get_moves(self, position, color):
+        # The quiet moves and the captures of a side, with every intermediate step of the captures (Position.get_captures with partial=True),
+        # which is what the user interface needs to highlight moves and check the player's clicks
+        key = (position.hash, color)
+        entries = self.entries
+        entry = entries.pop(key, None)
+        if entry is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            entry = (tuple(position.get_quiet_moves(color)), tuple(position.get_captures(color, partial=True)))
+            if len(entries) >= self.max_entries:
+                del entries[next(iter(entries))]
+        entries[key] = entry
+        return entry
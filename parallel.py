@@ -0,0 +1,133 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+from bitboard import Position, WHITE
+from search import Searcher, SearchTimeout
+from tablebase import Tablebase
+from transposition import TranspositionTable
+
+# Iterations shallower than this are searched in the main process: they are too small to be worth sending to the workers
+PARALLEL_MIN_DEPTH = 4
+# Transposition table size of each worker process
+WORKER_TT_SIZE_MB = 32
+# How often (in seconds) the main process checks for a stop request while it waits for the workers
+STOP_POLL_INTERVAL = 0.05
+
+# The transposition table and endgame tablebase of a worker process, created by the pool initializer and kept for the life of the process
+_worker_table = None
+_worker_tablebase = None
+
+
+def default_worker_count():
+    return os.cpu_count() or 1
+
+
+def create_pool(workers=None, table_size_mb=WORKER_TT_SIZE_MB, tablebase_path=None):
+    # Create the process pool used by ParallelSearcher. The pool can be kept and reused for every search of a game.
+    # Worker processes are started with "spawn" so that they do not inherit the parent's threads or Tk state.
+    # When tablebase_path is given, each worker maps the endgame tablebase file; the pages are shared between the processes by the operating system.
+    return ProcessPoolExecutor(max_workers=workers or default_worker_count(), mp_context=multiprocessing.get_context("spawn"),
+                               initializer=_init_worker, initargs=(table_size_mb, tablebase_path))
+
+
+def _init_worker(table_size_mb, tablebase_path):
+    global _worker_table, _worker_tablebase
+    _worker_table = TranspositionTable(table_size_mb)
+    if tablebase_path is not None:
+        _worker_tablebase = Tablebase(tablebase_path)
+
+
+def _search_root_move(position_state, move, depth, alpha, beta, generation, time_left_ms):
+    # Worker task: play one root move and search the resulting position to depth - 1 with the given window.
+    # Returns (score, nodes), with a score of None when the time budget ran out.
+    position = Position(*position_state)
+    position.apply(move)
+    _worker_table.generation = generation
+    searcher = Searcher(position, _worker_table, deterministic=True, tablebase=_worker_tablebase)
+    if time_left_ms is not None:
+        searcher.deadline = time.perf_counter() + time_left_ms / 1000.0
+    try:
+        score = searcher.minimax(depth - 1, alpha, beta, position.turn == WHITE, None, 1)[0]
+    except SearchTimeout:
+        return None, searcher.stats.nodes
+    return score, searcher.stats.nodes
+
+
+def search_position(position_state, max_depth, time_ms):
+    # Worker task: search a whole position with iterative deepening in a worker process of a pool made by create_pool.
+    # Returns (score, best_move, principal_variation, stats as a dict). Callers ask for a depth and want its score and principal variation,
+    # so a forced move is searched to the full depth as well.
+    position = Position(*position_state)
+    searcher = Searcher(position, _worker_table, tablebase=_worker_tablebase, search_forced_moves=True)
+    score, best_move = searcher.search(max_depth, time_ms)
+    return score, best_move, searcher.stats.principal_variation, searcher.stats.as_dict()
+
+
+class ParallelSearcher(Searcher):
+    # The ParallelSearcher class splits the root moves of the search across a pool of worker processes, since threads cannot run Python code in parallel.
+    # Each iteration first searches the first root move (the best move of the previous iteration) in this process with a full window, which gives the score to beat.
+    # The other root moves are then searched by the workers in parallel, each with the window that only lets through scores better than the first move's.
+    # Searches run in deterministic mode, and the root moves are ordered only by the previous iteration's best move, so at a fixed depth
+    # the best move returned is the same as the one returned by a serial Searcher(position, deterministic=True).search(depth),
+    # as long as both use the same endgame tablebase (the workers get theirs from create_pool).
+
+    def __init__(self, position, executor, transposition_table=None, stop_event=None, tablebase=None):
+        super().__init__(position, transposition_table, deterministic=True, stop_event=stop_event, tablebase=tablebase)
+        self.executor = executor
+
+    def search_iteration(self, depth, maximizing_player):
+        # Search the root to the given depth, sending all root moves but the first one to the worker processes
+        if depth < PARALLEL_MIN_DEPTH or self.position.is_game_over():
+            return super().search_iteration(depth, maximizing_player)
+
+        position = self.position
+        self.stats.nodes += 1
+        alpha, beta = float('-inf'), float('inf')
+        result, alpha, beta, hash_move = self.probe_table(depth, alpha, beta)
+        if result is not None:
+            return result
+        moves = self.order_moves(position.get_legal_moves(position.turn), hash_move, 0)
+
+        # The first move is searched here with the full window. It is usually the best move, and its score bounds the window of the others.
+        undo = position.apply(moves[0])
+        best_eval = self.minimax(depth - 1, alpha, beta, not maximizing_player, None, 1)[0]
+        position.undo(undo)
+        best_move = moves[0]
+        if len(moves) > 1:
+            if maximizing_player:
+                window = (best_eval, float('inf'))
+            else:
+                window = (float('-inf'), best_eval)
+            time_left_ms = None
+            if self.deadline is not None:
+                time_left_ms = max(0.0, (self.deadline - time.perf_counter()) * 1000.0)
+            state = (position.black_men, position.black_kings, position.white_men, position.white_kings, position.turn)
+            futures = [self.executor.submit(_search_root_move, state, move, depth, window[0], window[1],
+                                            self.transposition_table.generation, time_left_ms) for move in moves[1:]]
+            scores = []
+            try:
+                for future in futures:
+                    while True:
+                        try:
+                            score, nodes = future.result(timeout=STOP_POLL_INTERVAL)
+                            break
+                        except TimeoutError:
+                            if self.stop_requested():
+                                raise SearchTimeout()
+                    self.stats.nodes += nodes
+                    if score is None:
+                        raise SearchTimeout()
+                    scores.append(score)
+            except SearchTimeout:
+                for future in futures:
+                    future.cancel()
+                raise
+            # Go through the moves in search order and only take a strictly better score, as the serial search does
+            for move, score in zip(moves[1:], scores):
+                if (score > best_eval) if maximizing_player else (score < best_eval):
+                    best_eval = score
+                    best_move = move
+        self.store_result(depth, best_eval, float('-inf'), float('inf'), best_move)
+        return best_eval, best_move
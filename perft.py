@@ -0,0 +1,119 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+from bitboard import Position, BLACK, WHITE, BLACK_KING, WHITE_KING, BOARD_SIZE, square_to_number, unpack_move
+
+# Reference leaf counts of the start position and the stored test positions, checked in next to this file
+REFERENCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "perft_positions.json")
+DEFAULT_DEPTH = 6
+
+# Characters of the board diagrams in the reference file: black men, black kings, white men, white kings and empty squares
+PIECE_CHARS = {BLACK: "b", BLACK_KING: "B", WHITE: "w", WHITE_KING: "W", "": "."}
+CHAR_PIECES = {char: piece for piece, char in PIECE_CHARS.items()}
+
+
+def perft(position, depth, move_lists=None):
+    # Count the leaf nodes of the move tree of a position to the given depth, a multi-jump capture counting as one move.
+    # Comparing the counts with known values checks the move generator, and timing them measures its speed.
+    # Every depth generates its moves into its own list of move_lists, which is reused across the whole tree.
+    if depth == 0:
+        return 1
+    if move_lists is None:
+        move_lists = [[] for _ in range(depth + 1)]
+    moves = position.get_legal_moves(position.turn, move_lists[depth])
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        undo = position.apply(move)
+        nodes += perft(position, depth - 1, move_lists)
+        position.undo(undo)
+    return nodes
+
+
+def divide(position, depth):
+    # Return the leaf count below each legal move of the position, useful to find which move a wrong count comes from
+    result = []
+    for move in position.get_legal_moves(position.turn):
+        undo = position.apply(move)
+        result.append((move, perft(position, depth - 1)))
+        position.undo(undo)
+    return result
+
+
+def parse_diagram(rows, turn):
+    # Build a position from 8 rows of text, top row first, using the characters of PIECE_CHARS
+    board = [[CHAR_PIECES[char] for char in row] for row in rows]
+    if len(board) != BOARD_SIZE or any(len(row) != BOARD_SIZE for row in board):
+        raise ValueError("a board diagram needs %d rows of %d squares" % (BOARD_SIZE, BOARD_SIZE))
+    return Position.from_board(board, turn)
+
+
+def format_diagram(position):
+    return ["".join(PIECE_CHARS[piece] for piece in row) for row in position.to_board()]
+
+
+def load_positions(path=REFERENCE_PATH):
+    # Return the stored test positions as a list of (name, position, reference counts for depths 1, 2, ...)
+    with open(path) as f:
+        entries = json.load(f)
+    positions = []
+    for entry in entries:
+        if entry.get("board") is None:
+            position = Position.initial()
+        else:
+            position = parse_diagram(entry["board"], entry["turn"])
+        positions.append((entry["name"], position, entry["nodes"]))
+    return positions
+
+
+def run(name, position, depth, reference):
+    # Run perft at every depth up to depth, print the counts and speed, and return False if a count differs from the reference
+    ok = True
+    print(name)
+    for current in range(1, depth + 1):
+        start = time.perf_counter()
+        nodes = perft(position, current)
+        elapsed = time.perf_counter() - start
+        if current <= len(reference):
+            status = "ok" if nodes == reference[current - 1] else "MISMATCH (expected %d)" % reference[current - 1]
+            ok = ok and nodes == reference[current - 1]
+        else:
+            status = "no reference"
+        print("  depth %2d %12d nodes %8.3fs %10.0f nodes/s  %s" % (current, nodes, elapsed, nodes / elapsed if elapsed else 0.0, status))
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Count the leaf nodes of the checkers move tree and check them against the reference values.")
+    parser.add_argument("--depth", type=int, default=DEFAULT_DEPTH, help="deepest depth to count (default %d)" % DEFAULT_DEPTH)
+    parser.add_argument("--position", help="only run the stored position with this name")
+    parser.add_argument("--divide", action="store_true", help="print the count below each root move at the given depth")
+    parser.add_argument("--reference", default=REFERENCE_PATH, help="file with the stored positions and their reference counts")
+    args = parser.parse_args(argv)
+
+    positions = load_positions(args.reference)
+    if args.position is not None:
+        positions = [entry for entry in positions if entry[0] == args.position]
+        if not positions:
+            parser.error("no stored position named %r" % args.position)
+
+    ok = True
+    for name, position, reference in positions:
+        if args.divide:
+            print(name)
+            for move, nodes in divide(position, args.depth):
+                from_square, to_square, _ = unpack_move(move)
+                print("  %2d-%2d %12d" % (square_to_number(from_square), square_to_number(to_square), nodes))
+        else:
+            ok = run(name, position, args.depth, reference) and ok
+    if not args.divide:
+        print("all counts match" if ok else "some counts do not match the reference values")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
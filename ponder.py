@@ -0,0 +1,93 @@
+import threading
+import time
+
+from bitboard import WHITE
+from search import Searcher, SearchTimeout
+
+# Number of the opponent's most likely replies that are searched ahead of time
+PONDER_REPLIES = 3
+# Depth of the quick search used to guess the opponent's most likely replies
+PREDICTION_DEPTH = 3
+
+
+class Ponderer:
+    # The Ponderer class uses the time the human player spends thinking to search ahead for the AI's next move.
+    # It guesses the player's most likely replies with a quick search, then deepens a search of the position after each of them in turn, one depth at a time, until it is stopped.
+    # The results go into the transposition table shared with the AI, so when the player makes one of the predicted moves the AI's own search
+    # finds most of the work already done and gets deeper in the same time. The best move found for each predicted position is also kept,
+    # so the AI can answer straight away when the pondering already went as deep as its own search would.
+
+    def __init__(self, position, transposition_table, max_depth, replies=PONDER_REPLIES, tablebase=None):
+        # position is the position the player faces, with the player to move
+        self.position = position.copy()
+        self.transposition_table = transposition_table
+        self.max_depth = max_depth
+        self.replies = replies
+        self.tablebase = tablebase
+        self.stop_event = threading.Event()
+        self.predicted_moves = []
+        # Zobrist hash of the position after a predicted reply -> (depth, score, best_move, stats) of the deepest completed search
+        self.results = {}
+        self.thread = None
+
+    def start(self):
+        # Start pondering on a background thread
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        # Stop pondering and wait for the background thread to finish
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        # Guess the likely replies, then deepen the search after each of them until stopped or max_depth is reached
+        try:
+            self.transposition_table.new_search()
+            replies = self.predict_replies()
+            for depth in range(1, self.max_depth + 1):
+                for move, position in replies:
+                    searcher = Searcher(position, self.transposition_table, stop_event=self.stop_event, tablebase=self.tablebase)
+                    start = time.perf_counter()
+                    score, best_move = searcher.minimax(depth, float('-inf'), float('inf'), position.turn == WHITE)
+                    # Fill in the result of the search the way Searcher.search does, for the info panel.
+                    # Like the iterations of Searcher.search, the nodes and time add up over all the depths searched for the position.
+                    stats = searcher.stats
+                    stats.depth = depth
+                    stats.elapsed_ms = (time.perf_counter() - start) * 1000.0
+                    previous = self.results.get(position.hash)
+                    if previous is not None:
+                        stats.nodes += previous[3].nodes
+                        stats.elapsed_ms += previous[3].elapsed_ms
+                        stats.iteration_nodes = previous[3].iteration_nodes + [stats.nodes]
+                    else:
+                        stats.iteration_nodes.append(stats.nodes)
+                    stats.score = score
+                    stats.best_move = best_move
+                    stats.principal_variation = searcher.principal_variation()
+                    stats.pondered = True
+                    self.results[position.hash] = (depth, score, best_move, stats)
+        except SearchTimeout:
+            pass
+
+    def predict_replies(self):
+        # Score every legal reply of the player with a quick search and keep the best ones from the player's point of view.
+        # Returns a list of (move, position after the move).
+        position = self.position
+        scored = []
+        for move in position.get_legal_moves(position.turn):
+            child = position.copy()
+            child.apply(move)
+            searcher = Searcher(child, self.transposition_table, stop_event=self.stop_event, tablebase=self.tablebase)
+            score = searcher.minimax(PREDICTION_DEPTH, float('-inf'), float('inf'), child.turn == WHITE)[0]
+            scored.append((score, len(scored), move, child))
+        # The player is the opponent of the side to move in the children, so a low score is good for the player when the AI is white
+        scored.sort(reverse=position.turn == WHITE)
+        self.predicted_moves = [move for _, _, move, _ in scored[:self.replies]]
+        return [(move, child) for _, _, move, child in scored[:self.replies]]
+
+    def lookup(self, position):
+        # Return (depth, score, best_move, stats) of the pondering search of a position, or None when the position was not predicted
+        return self.results.get(position.hash)
@@ -0,0 +1,519 @@
+import time
+
+from bitboard import Position, BLACK, WHITE, MOVE_CAPTURED_SHIFT, MOVE_PATH_MASK
+from transposition import TranspositionTable, EXACT, LOWER_BOUND, UPPER_BOUND
+from tablebase import LOSS as TABLEBASE_LOSS
+
+# How often (in nodes) the search checks the clock
+TIME_CHECK_INTERVAL = 1024
+# Deepest ply for which killer moves and move lists are kept
+MAX_PLY = 128
+# Ordering scores for quiet moves: the hash move first, then the two killer moves, then the history score
+HASH_MOVE_SCORE = 1 << 30
+KILLER_SCORES = (1 << 29, (1 << 29) - 1)
+# Most nodes the quiescence search may visit below one leaf of the main search before it settles for the static evaluation
+QUIESCENCE_NODE_BUDGET = 256
+# Score of a position the endgame tablebase knows to be won, less the number of plies to the win, so that faster wins score higher
+TABLEBASE_WIN_SCORE = 1000
+
+
+class SearchTimeout(Exception):
+    # Raised inside the search when the time budget of an iterative deepening search runs out or the search is told to stop
+    pass
+
+
+class SearchStats:
+    # The SearchStats class collects the counters of a search: the number of nodes visited, the transposition table probes and hits, and the depth reached.
+    # When the search is run with timing=True it also splits the search time between move generation, playing and taking back moves, and evaluation.
+    # search fills in the result as well: the score, the best move and the principal variation.
+    # pondered is set on the stats of a search run by a Ponderer on the player's time (see ponder.py).
+
+    def __init__(self):
+        self.nodes = 0
+        self.interior_nodes = 0
+        self.moves_searched = 0
+        self.iteration_nodes = []
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.tt_cutoffs = 0
+        self.depth = 0
+        self.elapsed_ms = 0.0
+        self.pondered = False
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+        self.cutoff_move_index_total = 0
+        self.tablebase_hits = 0
+        self.quiescence_nodes = 0
+        self.quiescence_cutoffs = 0
+        self.quiescence_budget_exhausted = 0
+        self.max_ply = 0
+        self.movegen_ms = 0.0
+        self.apply_ms = 0.0
+        self.eval_ms = 0.0
+        self.score = None
+        self.best_move = None
+        self.principal_variation = []
+
+    def nodes_per_second(self):
+        return self.nodes * 1000.0 / self.elapsed_ms if self.elapsed_ms else 0.0
+
+    def branching_factor(self):
+        # Average number of moves searched below a node that was expanded, after alpha-beta cutoffs
+        return self.moves_searched / self.interior_nodes if self.interior_nodes else 0.0
+
+    def effective_branching_factor(self):
+        # How many times more nodes the last completed iteration of iterative deepening needed than the one before it
+        if len(self.iteration_nodes) < 2:
+            return 0.0
+        previous = self.iteration_nodes[-2] - (self.iteration_nodes[-3] if len(self.iteration_nodes) > 2 else 0)
+        last = self.iteration_nodes[-1] - self.iteration_nodes[-2]
+        return last / previous if previous else 0.0
+
+    def cutoff_rate(self):
+        # Fraction of the expanded nodes that ended with a beta cutoff
+        return self.cutoffs / self.interior_nodes if self.interior_nodes else 0.0
+
+    def tt_hit_rate(self):
+        return self.tt_hits / self.tt_probes if self.tt_probes else 0.0
+
+    def first_move_cutoff_rate(self):
+        # Fraction of beta cutoffs caused by the first move searched. The closer to 1, the better the move ordering.
+        return self.first_move_cutoffs / self.cutoffs if self.cutoffs else 0.0
+
+    def average_cutoff_index(self):
+        # Average position (0 is first) in the ordered move list of the move that caused a beta cutoff
+        return self.cutoff_move_index_total / self.cutoffs if self.cutoffs else 0.0
+
+    def as_dict(self):
+        return {
+            "nodes": self.nodes,
+            "depth": self.depth,
+            "elapsed_ms": round(self.elapsed_ms, 1),
+            "nodes_per_second": round(self.nodes_per_second()),
+            "interior_nodes": self.interior_nodes,
+            "branching_factor": round(self.branching_factor(), 3),
+            "effective_branching_factor": round(self.effective_branching_factor(), 3),
+            "iteration_nodes": list(self.iteration_nodes),
+            "cutoff_rate": round(self.cutoff_rate(), 4),
+            "tt_probes": self.tt_probes,
+            "tt_hits": self.tt_hits,
+            "tt_hit_rate": round(self.tt_hit_rate(), 4),
+            "tt_cutoffs": self.tt_cutoffs,
+            "cutoffs": self.cutoffs,
+            "first_move_cutoff_rate": round(self.first_move_cutoff_rate(), 4),
+            "average_cutoff_index": round(self.average_cutoff_index(), 3),
+            "tablebase_hits": self.tablebase_hits,
+            "quiescence_nodes": self.quiescence_nodes,
+            "quiescence_cutoffs": self.quiescence_cutoffs,
+            "quiescence_budget_exhausted": self.quiescence_budget_exhausted,
+            "max_ply": self.max_ply,
+            "movegen_ms": round(self.movegen_ms, 1),
+            "apply_ms": round(self.apply_ms, 1),
+            "eval_ms": round(self.eval_ms, 1),
+            "score": self.score,
+            "best_move": self.best_move,
+            "principal_variation": list(self.principal_variation),
+        }
+
+
+class TimedPosition(Position):
+    # A Position that adds the time spent generating moves, playing and taking back moves, and evaluating to a SearchStats.
+    # The search uses it instead of the real position when it is run with timing=True; the timer calls slow the search down, so timing is off by default.
+
+    __slots__ = ("stats",)
+
+    @classmethod
+    def wrap(cls, position, stats):
+        timed = cls(position.black_men, position.black_kings, position.white_men, position.white_kings, position.turn)
+        timed.stats = stats
+        return timed
+
+    def get_legal_moves(self, color, moves=None):
+        start = time.perf_counter()
+        moves = Position.get_captures(self, color, moves=moves) or self.get_quiet_moves(color, moves=moves)
+        self.stats.movegen_ms += (time.perf_counter() - start) * 1000.0
+        return moves
+
+    def get_captures(self, color, pieces_mask=0xFFFFFFFF, partial=False, moves=None):
+        start = time.perf_counter()
+        captures = Position.get_captures(self, color, pieces_mask, partial, moves)
+        self.stats.movegen_ms += (time.perf_counter() - start) * 1000.0
+        return captures
+
+    def has_moves(self, color):
+        start = time.perf_counter()
+        result = Position.has_moves(self, color)
+        self.stats.movegen_ms += (time.perf_counter() - start) * 1000.0
+        return result
+
+    def apply(self, move):
+        start = time.perf_counter()
+        record = Position.apply(self, move)
+        self.stats.apply_ms += (time.perf_counter() - start) * 1000.0
+        return record
+
+    def undo(self, record):
+        start = time.perf_counter()
+        Position.undo(self, record)
+        self.stats.apply_ms += (time.perf_counter() - start) * 1000.0
+
+    def evaluate(self):
+        start = time.perf_counter()
+        score = Position.evaluate(self)
+        self.stats.eval_ms += (time.perf_counter() - start) * 1000.0
+        return score
+
+
+class Searcher:
+    # The Searcher class runs the Minimax search with alpha-beta pruning on a bitboard Position.
+    # Moves are played and taken back in place with Position.apply and Position.undo, so every node of the tree is the real position reached by the moves leading to it
+    # and no board copies are made during the search.
+    # Results are stored in a transposition table keyed by the position's Zobrist hash, so positions reached again through a different move order are not searched twice.
+    # The table can be shared between searches (and between turns of a game) by passing the same TranspositionTable to each Searcher.
+    # The search method runs iterative deepening under a time budget; minimax can also be called directly for a fixed-depth search.
+    # Moves are ordered so that alpha-beta cutoffs come early: the transposition table move first, then the longest capture sequences,
+    # then for quiet moves the killer moves of the ply (quiet moves that recently caused a cutoff at the same depth in the tree) and the history table score.
+    # With deterministic=True a stored result only ends the search of a node when it was searched to exactly the same depth,
+    # so the score of a fixed-depth search does not depend on what else is in the table (see parallel.py).
+    # Leaves where the side to move has a capture are not evaluated straight away: a quiescence search plays out the captures first (see quiescence),
+    # so that the evaluation is not taken in the middle of an exchange.
+    # With an endgame tablebase (see tablebase.py), positions with few enough pieces left are not searched: their exact result is looked up instead.
+    # Each ply below the root generates its moves into a list of its own that is kept for the whole search, so the inner loop does not allocate move lists.
+    # With timing=True the search runs on a TimedPosition copy of the position, which records where the search time goes in the stats.
+    # A search running in another thread can be stopped early by setting its stop_event (a threading.Event); it then returns the result of the last completed iteration.
+    # When the side to move has a single legal move, search stops after depth 1, since the move is forced; with search_forced_moves=True
+    # it goes on to the full depth anyway, for callers that want the score and principal variation of the requested depth.
+    # The AI (white) is the maximizing player and the human player (black) is the minimizing player.
+
+    def __init__(self, position, transposition_table=None, deterministic=False, stop_event=None, tablebase=None,
+                 quiescence_budget=QUIESCENCE_NODE_BUDGET, timing=False, search_forced_moves=False):
+        self.stats = SearchStats()
+        self.position = TimedPosition.wrap(position, self.stats) if timing else position
+        self.transposition_table = transposition_table if transposition_table is not None else TranspositionTable()
+        self.deterministic = deterministic
+        self.stop_event = stop_event
+        self.tablebase = tablebase
+        # quiescence_budget is the node budget of the quiescence search below each leaf, 0 turns the quiescence search off
+        self.quiescence_budget = quiescence_budget
+        self.quiescence_nodes_left = 0
+        self.deadline = None
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        # History scores of quiet moves, indexed by the from and to squares of the move (its low ten bits)
+        self.history = [0] * (MOVE_PATH_MASK + 1)
+        self.move_lists = [[] for _ in range(MAX_PLY)]
+        self.search_forced_moves = search_forced_moves
+
+    @property
+    def nodes(self):
+        return self.stats.nodes
+
+    def search(self, max_depth, time_ms=None):
+        # Search the position with iterative deepening: depth 1, then 2, and so on up to max_depth, until the time budget (in milliseconds) runs out.
+        # Each iteration stores its results in the transposition table, and the best move of every node from the previous iteration (the principal variation) is searched first in the next one.
+        # An iteration that runs out of time is thrown away, so the returned (score, best_move) always comes from the last completed iteration.
+        # The first iteration always completes so that a move is returned even with a very small budget,
+        # unless the stop event is set first, in which case the first of the ordered legal moves is returned.
+
+        position = self.position
+        root = position.copy()
+        maximizing_player = position.turn == WHITE
+        moves = position.get_legal_moves(position.turn)
+        start = time.perf_counter()
+        self.deadline = None
+        self.transposition_table.new_search()
+        self.age_history()
+        if not moves:
+            return (float('-inf') if maximizing_player else float('inf')), None
+
+        score, best_move = position.evaluate(), self.order_moves(moves, None, 0)[0]
+        for depth in range(1, max_depth + 1):
+            try:
+                score, best_move = self.search_iteration(depth, maximizing_player)
+            except SearchTimeout:
+                position.assign(root)
+                break
+            self.stats.depth = depth
+            self.stats.iteration_nodes.append(self.stats.nodes)
+            if (len(moves) == 1 and not self.search_forced_moves) or self.stop_requested():
+                # A forced move needs no deeper search
+                break
+            if time_ms is not None:
+                self.deadline = start + time_ms / 1000.0
+                if time.perf_counter() >= self.deadline:
+                    break
+        self.deadline = None
+        stats = self.stats
+        stats.elapsed_ms = (time.perf_counter() - start) * 1000.0
+        stats.score = score
+        stats.best_move = best_move
+        stats.principal_variation = self.principal_variation()
+        return score, best_move
+
+    def stop_requested(self):
+        return self.stop_event is not None and self.stop_event.is_set()
+
+    def should_stop(self):
+        # True when the time budget has run out or the search has been told to stop
+        return (self.deadline is not None and time.perf_counter() >= self.deadline) or self.stop_requested()
+
+    def search_iteration(self, depth, maximizing_player):
+        # Run one iteration of the iterative deepening search, a full-window search of the root to the given depth
+        return self.minimax(depth, float('-inf'), float('inf'), maximizing_player)
+
+    def score_root_moves(self, depth):
+        # Search every legal move of the side to move to depth - 1 with a full window and return (score, move) for each of them.
+        # Unlike the scores of an alpha-beta search of the root, these are exact for every move, so nearly equal moves can be told apart (see arena.play_game).
+        position = self.position
+        scores = []
+        for move in position.get_legal_moves(position.turn):
+            record = position.apply(move)
+            scores.append((self.minimax(depth - 1, float('-inf'), float('inf'), position.turn == WHITE, None, 1)[0], move))
+            position.undo(record)
+        return scores
+
+    def age_history(self):
+        # Halve the history scores so that the statistics of older searches fade out
+        history = self.history
+        for index in range(len(history)):
+            history[index] >>= 1
+
+    def order_moves(self, moves, hash_move, ply):
+        # Sort the moves in place so that the ones most likely to cause a cutoff are searched first.
+        # Capture lists are sorted by the number of pieces captured, longest first. Quiet moves are sorted by killer and history scores.
+        # In both cases the hash move, when there is one, goes first.
+        # At the root, quiet moves are only ordered by the hash move, so that the root move order only depends on the result of the previous iteration.
+        if len(moves) < 2:
+            return moves
+        if moves[0] >> MOVE_CAPTURED_SHIFT:
+            moves.sort(key=lambda move: (move == hash_move, (move >> MOVE_CAPTURED_SHIFT).bit_count()), reverse=True)
+            return moves
+        if ply == 0:
+            moves.sort(key=lambda move: move == hash_move, reverse=True)
+            return moves
+        killers = self.killers[ply] if ply < MAX_PLY else (None, None)
+        history = self.history
+
+        def score(move):
+            if move == hash_move:
+                return HASH_MOVE_SCORE
+            if move == killers[0]:
+                return KILLER_SCORES[0]
+            if move == killers[1]:
+                return KILLER_SCORES[1]
+            return history[move & MOVE_PATH_MASK]
+
+        moves.sort(key=score, reverse=True)
+        return moves
+
+    def record_cutoff(self, move, depth, ply, index):
+        # Update the cutoff statistics, and the killer and history tables when the move that caused the cutoff is a quiet move
+        stats = self.stats
+        stats.cutoffs += 1
+        stats.cutoff_move_index_total += index
+        if index == 0:
+            stats.first_move_cutoffs += 1
+        if move >> MOVE_CAPTURED_SHIFT:
+            return
+        if ply < MAX_PLY:
+            killers = self.killers[ply]
+            if killers[0] != move:
+                killers[1] = killers[0]
+                killers[0] = move
+        self.history[move & MOVE_PATH_MASK] += depth * depth
+
+    def principal_variation(self, max_length=20):
+        # Follow the best moves stored in the transposition table from the current position to get the expected line of play
+        position = self.position
+        records = []
+        line = []
+        seen = set()
+        while len(line) < max_length and position.hash not in seen:
+            seen.add(position.hash)
+            entry = self.transposition_table.entries[position.hash & self.transposition_table.mask]
+            if entry is None or entry[0] != position.hash or entry[4] is None:
+                break
+            move = entry[4]
+            if move not in position.get_legal_moves(position.turn):
+                break
+            line.append(move)
+            records.append(position.apply(move))
+        for record in reversed(records):
+            position.undo(record)
+        return line
+
+    def minimax(self, depth, alpha, beta, maximizing_player, moves=None, ply=0):
+        # The method helps determine the best move for a player by evaluating all possible moves and their outcomes, assuming that the opponent plays optimally.
+        # The algorithm recursively explores the game tree, alternating between maximizing the score for the current player and minimizing the score for the opponent.
+        # When moves is None the legal moves of the side to move are generated. A side without pieces or moves scores as a loss.
+        # Stored results that are deep enough end the search of a node early, and the stored best move is searched first otherwise.
+        # When moves is given it may be a restricted list, so the table is neither probed nor updated for that node.
+        # ply is the distance from the root, used to index the killer moves.
+        # Below the root, positions covered by the endgame tablebase score as the tablebase result and are not searched.
+
+        position = self.position
+        stats = self.stats
+        stats.nodes += 1
+        if not stats.nodes % TIME_CHECK_INTERVAL and self.should_stop():
+            raise SearchTimeout()
+        if position.is_game_over():
+            # The side without pieces, or the side to move when it has no legal move, has lost
+            return (float('-inf') if position.loser() == WHITE else float('inf')), None
+        if self.tablebase is not None and ply > 0 and sum(position.counts) <= self.tablebase.max_pieces:
+            score = self.probe_tablebase()
+            if score is not None:
+                return score, None
+        if depth == 0:
+            if self.quiescence_budget:
+                self.quiescence_nodes_left = self.quiescence_budget
+                return self.quiescence(alpha, beta, ply), None
+            return position.evaluate(), None
+
+        original_alpha, original_beta = alpha, beta
+        use_table = moves is None
+        hash_move = None
+        if use_table:
+            result, alpha, beta, hash_move = self.probe_table(depth, alpha, beta)
+            if result is not None:
+                return result
+            moves = position.get_legal_moves(WHITE if maximizing_player else BLACK, self.move_lists[ply] if ply < MAX_PLY else None)
+        else:
+            moves = list(moves)
+        self.order_moves(moves, hash_move, ply)
+
+        # best_move starts as the first move so that a lost position, where every move scores as a loss, still returns a move to play
+        stats.interior_nodes += 1
+        if maximizing_player:
+            best_eval = float('-inf')
+            best_move = moves[0] if moves else None
+            for index, move in enumerate(moves):
+                stats.moves_searched += 1
+                undo = position.apply(move)
+                eval = self.minimax(depth - 1, alpha, beta, False, None, ply + 1)[0]
+                position.undo(undo)
+                if eval > best_eval:
+                    best_eval = eval
+                    best_move = move
+                alpha = max(alpha, eval)
+                if beta <= alpha:
+                    self.record_cutoff(move, depth, ply, index)
+                    break
+        else:
+            best_eval = float('inf')
+            best_move = moves[0] if moves else None
+            for index, move in enumerate(moves):
+                stats.moves_searched += 1
+                undo = position.apply(move)
+                eval = self.minimax(depth - 1, alpha, beta, True, None, ply + 1)[0]
+                position.undo(undo)
+                if eval < best_eval:
+                    best_eval = eval
+                    best_move = move
+                beta = min(beta, eval)
+                if beta <= alpha:
+                    self.record_cutoff(move, depth, ply, index)
+                    break
+
+        if use_table:
+            self.store_result(depth, best_eval, original_alpha, original_beta, best_move)
+        return best_eval, best_move
+
+    def quiescence(self, alpha, beta, ply):
+        # Search only the capture sequences from a leaf of the main search until the position is quiet, and return its score from the AI's point of view.
+        # Captures are mandatory, so there is no option to stand pat: when the side to move can capture, its score is the best of its captures.
+        # The search gives up and returns the static evaluation once it has used up the node budget of the leaf,
+        # which depends only on the leaf's own captures, so the score of a fixed-depth search stays the same whatever was searched before.
+        position = self.position
+        stats = self.stats
+        if ply > stats.max_ply:
+            stats.max_ply = ply
+        captures = position.get_captures(position.turn, moves=self.move_lists[ply] if ply < MAX_PLY else None)
+        if not captures:
+            # The callers have already checked that the game is not over, so the position is quiet
+            return position.evaluate()
+        if self.quiescence_nodes_left <= 0:
+            stats.quiescence_budget_exhausted += 1
+            return position.evaluate()
+        self.order_moves(captures, None, ply)
+
+        maximizing_player = position.turn == WHITE
+        best_eval = float('-inf') if maximizing_player else float('inf')
+        stats.interior_nodes += 1
+        for move in captures:
+            stats.moves_searched += 1
+            self.quiescence_nodes_left -= 1
+            stats.nodes += 1
+            stats.quiescence_nodes += 1
+            undo = position.apply(move)
+            if position.is_game_over():
+                eval = float('-inf') if position.loser() == WHITE else float('inf')
+            else:
+                eval = self.quiescence(alpha, beta, ply + 1)
+            position.undo(undo)
+            if maximizing_player:
+                best_eval = max(best_eval, eval)
+                alpha = max(alpha, eval)
+            else:
+                best_eval = min(best_eval, eval)
+                beta = min(beta, eval)
+            if beta <= alpha:
+                stats.quiescence_cutoffs += 1
+                break
+        return best_eval
+
+    def probe_tablebase(self):
+        # Look the current position up in the endgame tablebase.
+        # Returns its score from the AI's point of view, or None when the tablebase does not cover the position.
+        entry = self.tablebase.probe(self.position)
+        if entry is None:
+            return None
+        self.stats.tablebase_hits += 1
+        result, distance = entry
+        if result is None:
+            return 0
+        score = TABLEBASE_WIN_SCORE - distance
+        if (result == TABLEBASE_LOSS) == (self.position.turn == WHITE):
+            score = -score
+        return score
+
+    def probe_table(self, depth, alpha, beta):
+        # Look the current position up in the transposition table.
+        # Returns (result, alpha, beta, hash_move): result is the (score, move) to return straight away when the stored entry is deep enough to decide the node,
+        # otherwise None together with the window narrowed by the stored bound and the stored best move for move ordering.
+        stats = self.stats
+        stats.tt_probes += 1
+        entry = self.transposition_table.probe(self.position.hash)
+        if entry is None:
+            return None, alpha, beta, None
+        stats.tt_hits += 1
+        _, entry_depth, entry_score, entry_bound, hash_move, _ = entry
+        if entry_depth == depth or (entry_depth > depth and not self.deterministic):
+            if entry_bound == EXACT:
+                stats.tt_cutoffs += 1
+                return (entry_score, hash_move), alpha, beta, hash_move
+            if entry_bound == LOWER_BOUND:
+                alpha = max(alpha, entry_score)
+            elif entry_bound == UPPER_BOUND:
+                beta = min(beta, entry_score)
+            if beta <= alpha:
+                stats.tt_cutoffs += 1
+                return (entry_score, hash_move), alpha, beta, hash_move
+        return None, alpha, beta, hash_move
+
+    def store_result(self, depth, score, original_alpha, original_beta, best_move):
+        # Store the result of a node in the transposition table with the bound type implied by the search window
+        if score <= original_alpha:
+            bound = UPPER_BOUND
+        elif score >= original_beta:
+            bound = LOWER_BOUND
+        else:
+            bound = EXACT
+        self.transposition_table.store(self.position.hash, depth, score, bound, best_move)
+
+
+def analyze(position, max_depth, time_ms=None, transposition_table=None, tablebase=None, timing=False):
+    # Search a position without any user interface and return the SearchStats of the search,
+    # which hold the score, the best move and the principal variation along with all the counters.
+    # The position itself is not changed; the side to move is the one whose turn it is. A forced move is searched to the full depth as well.
+    searcher = Searcher(position.copy(), transposition_table, tablebase=tablebase, timing=timing, search_forced_moves=True)
+    searcher.search(max_depth, time_ms)
+    return searcher.stats
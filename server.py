@@ -0,0 +1,332 @@
+import argparse
+import asyncio
+import collections
+import json
+import math
+import signal
+import sys
+import time
+
+from bitboard import Position, format_move, parse_move
+from parallel import create_pool, default_worker_count, search_position
+
+# The engine server protocol is line-delimited JSON: each request is one JSON object on its own line, and each response is one line too.
+# Requests are handled concurrently, so responses may come back out of order; a response carries the "id" of its request when one was given.
+# Every request has a "cmd", and all but "metrics" a "session" name. The commands are:
+#   new      start (or restart) a session at the start position; optional "depth" and "time_ms" set the session's search limits
+#            (a time_ms of null means no time limit, the search then only stops at its depth or at the request's timeout)
+#   position set the position of a session to the start position followed by "moves", a list of moves in square notation ("11-15", "9x18x27")
+#   move     play "move" in the session's position
+#   legal    list the legal moves of the side to move
+#   go       search the session's position; optional "depth" and "time_ms" override the session's limits, "timeout_ms" limits the total time
+#            of the request including the time it waits for a free worker, and "play": true also plays the move found
+#   close    forget a session
+#   metrics  return the server's throughput, latency and queue metrics
+# A successful response has "ok": true and the command's results, a failed one "ok": false and an "error" message.
+# Scores are from white's point of view; a won or lost position scores "inf" or "-inf".
+DEFAULT_DEPTH = 8
+DEFAULT_TIME_MS = 1000
+DEFAULT_TIMEOUT_MS = 30000
+DEFAULT_QUEUE_LIMIT = 64
+DEFAULT_PORT = 8765
+# Number of recent "go" requests the latency percentiles are computed over
+LATENCY_WINDOW = 1000
+
+
+class RequestError(Exception):
+    # Raised by a command handler for a request that cannot be served; the message is sent back to the client
+    pass
+
+
+def number_field(request, name, default, minimum, integer=False, optional=False):
+    # Read a numeric field of a request, which must be a number of at least minimum (a whole number when integer is set),
+    # or null when optional is set. Raises RequestError otherwise.
+    value = request.get(name, default)
+    if value is None and optional:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) or value < minimum or (integer and value != int(value)):
+        raise RequestError("%s must be %s of at least %d%s" % (name, "a whole number" if integer else "a number", minimum, " or null" if optional else ""))
+    return int(value) if integer else value
+
+
+def json_score(score):
+    # Scores can be infinite, which JSON cannot represent
+    if math.isinf(score):
+        return "inf" if score > 0 else "-inf"
+    return score
+
+
+class Session:
+    # The Session class holds the state of one game served by the engine: its position, the moves played and its search limits
+
+    def __init__(self, depth=DEFAULT_DEPTH, time_ms=DEFAULT_TIME_MS):
+        self.position = Position.initial()
+        self.moves = []
+        self.depth = depth
+        self.time_ms = time_ms
+
+    def play(self, text):
+        move = parse_move(self.position, text)
+        self.moves.append(format_move(self.position, move))
+        self.position.apply(move)
+
+
+class EngineServer:
+    # The EngineServer class serves many games at once over a local socket.
+    # Sessions live in the server process, while searches run on a bounded pool of worker processes (see parallel.create_pool).
+    # At most one search per worker runs at a time; further "go" requests wait in a queue of at most queue_limit requests,
+    # and a request that cannot be finished within its timeout, waiting included, fails instead of holding up the queue.
+
+    def __init__(self, workers=None, queue_limit=DEFAULT_QUEUE_LIMIT, tablebase_path=None):
+        self.workers = workers or default_worker_count()
+        self.queue_limit = queue_limit
+        self.executor = create_pool(self.workers, tablebase_path=tablebase_path)
+        self.sessions = {}
+        self.slots = None
+        self.started = time.time()
+        self.requests = collections.Counter()
+        self.errors = 0
+        self.searches = 0
+        self.search_nodes = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.running = 0
+        self.latencies_ms = collections.deque(maxlen=LATENCY_WINDOW)
+        self.queue_waits_ms = collections.deque(maxlen=LATENCY_WINDOW)
+
+    async def serve(self, host="127.0.0.1", port=DEFAULT_PORT, unix_path=None):
+        # Accept connections until cancelled
+        self.slots = asyncio.Semaphore(self.workers)
+        try:
+            # Stop on SIGTERM as well as on Ctrl+C, so that the worker pool is shut down
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        except NotImplementedError:
+            pass
+        if unix_path is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, unix_path)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def handle_connection(self, reader, writer):
+        # Read request lines from one client and answer each of them as soon as it is done
+        lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                task = asyncio.create_task(self.answer(line, writer, lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            # The server is shutting down
+            pass
+        finally:
+            writer.close()
+
+    async def answer(self, line, writer, lock):
+        response = await self.handle_line(line)
+        async with lock:
+            writer.write((json.dumps(response) + "\n").encode())
+            await writer.drain()
+
+    async def handle_line(self, line):
+        # Decode a request line, run its command and return the response
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise RequestError("a request must be a JSON object")
+            request_id = request.get("id")
+            command = request.get("cmd")
+            handler = getattr(self, "command_%s" % command, None) if isinstance(command, str) else None
+            if handler is None:
+                raise RequestError("unknown command %r" % command)
+            self.requests[command] += 1
+            response = await handler(request)
+            response["ok"] = True
+        except (RequestError, ValueError) as error:
+            self.errors += 1
+            response = {"ok": False, "error": str(error)}
+        except Exception as error:
+            # A failed worker or a bug must not leave the client waiting for an answer forever
+            self.errors += 1
+            response = {"ok": False, "error": "internal error: %s" % error}
+        if request_id is not None:
+            response["id"] = request_id
+        return response
+
+    def session(self, request):
+        name = request.get("session")
+        if name not in self.sessions:
+            raise RequestError("unknown session %r" % name)
+        return self.sessions[name]
+
+    async def command_new(self, request):
+        name = request.get("session")
+        if not isinstance(name, str):
+            raise RequestError("a session name is needed")
+        depth = number_field(request, "depth", DEFAULT_DEPTH, 1, integer=True)
+        time_ms = number_field(request, "time_ms", DEFAULT_TIME_MS, 1, optional=True)
+        self.sessions[name] = Session(depth, time_ms)
+        return {"session": name}
+
+    async def command_position(self, request):
+        session = self.session(request)
+        replay = Session(session.depth, session.time_ms)
+        for text in request.get("moves", []):
+            replay.play(text)
+        session.position, session.moves = replay.position, replay.moves
+        return {"moves": list(session.moves)}
+
+    async def command_move(self, request):
+        session = self.session(request)
+        session.play(request.get("move", ""))
+        return {"moves": list(session.moves), "game_over": session.position.is_game_over()}
+
+    async def command_legal(self, request):
+        position = self.session(request).position
+        return {"turn": position.turn, "moves": [format_move(position, move) for move in position.get_legal_moves(position.turn)]}
+
+    async def command_close(self, request):
+        self.session(request)
+        del self.sessions[request["session"]]
+        return {}
+
+    async def command_go(self, request):
+        # Search the session's position on the worker pool, waiting for a free worker first if they are all busy
+        session = self.session(request)
+        position = session.position.copy()
+        if position.is_game_over():
+            raise RequestError("the game is over")
+        # The limits are checked before a worker is taken, so that a bad request cannot fail while holding one
+        depth = number_field(request, "depth", session.depth, 1, integer=True)
+        time_ms = number_field(request, "time_ms", session.time_ms, 1, optional=True)
+        timeout_ms = number_field(request, "timeout_ms", DEFAULT_TIMEOUT_MS, 1)
+        start = time.perf_counter()
+
+        if not self.slots.locked():
+            # A worker is free: this takes it without waiting
+            await self.slots.acquire()
+        else:
+            if self.waiting >= self.queue_limit:
+                self.rejected += 1
+                raise RequestError("the search queue is full")
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+            try:
+                await asyncio.wait_for(self.slots.acquire(), timeout_ms / 1000.0)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise RequestError("timed out waiting for a worker")
+            finally:
+                self.waiting -= 1
+        try:
+            waited_ms = (time.perf_counter() - start) * 1000.0
+            self.queue_waits_ms.append(waited_ms)
+
+            # The search gets whatever is left of the request's timeout, so that it finishes in time even without a time limit of its own
+            remaining_ms = max(1.0, timeout_ms - waited_ms)
+            search_ms = remaining_ms if time_ms is None else min(time_ms, remaining_ms)
+            state = (position.black_men, position.black_kings, position.white_men, position.white_kings, position.turn)
+            future = asyncio.get_running_loop().run_in_executor(self.executor, search_position, state, depth, search_ms)
+        except BaseException:
+            # No search was started, so the worker is free again
+            self.slots.release()
+            raise
+        self.running += 1
+        # The worker stays busy until the search really ends, even if the request gives up waiting for it
+        future.add_done_callback(lambda _: self.release_worker())
+        try:
+            score, best_move, line, stats = await asyncio.wait_for(asyncio.shield(future), remaining_ms / 1000.0 + 1.0)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise RequestError("the search did not finish in time")
+
+        self.searches += 1
+        self.search_nodes += stats["nodes"]
+        self.latencies_ms.append((time.perf_counter() - start) * 1000.0)
+        stats["score"] = json_score(stats["score"]) if stats["score"] is not None else None
+        response = {"move": format_move(position, best_move) if best_move is not None else None, "score": json_score(score),
+                    "principal_variation": self.format_line(position, line), "stats": stats}
+        if request.get("play") and best_move is not None and session.position == position:
+            session.play(response["move"])
+            response["moves"] = list(session.moves)
+        return response
+
+    def release_worker(self):
+        self.running -= 1
+        self.slots.release()
+
+    @staticmethod
+    def format_line(position, moves):
+        position = position.copy()
+        line = []
+        for move in moves:
+            line.append(format_move(position, move))
+            position.apply(move)
+        return line
+
+    async def command_metrics(self, request):
+        return self.metrics()
+
+    def metrics(self):
+        # Throughput, latency and queue metrics since the server started. Latencies cover the most recent "go" requests.
+        uptime = time.time() - self.started
+        latencies = sorted(self.latencies_ms)
+
+        def percentile(values, fraction):
+            return round(values[min(len(values) - 1, int(fraction * len(values)))], 1) if values else None
+
+        return {
+            "uptime_s": round(uptime, 1),
+            "sessions": len(self.sessions),
+            "workers": self.workers,
+            "requests": dict(self.requests),
+            "errors": self.errors,
+            "searches": self.searches,
+            "searches_per_second": round(self.searches / uptime, 3) if uptime else 0.0,
+            "nodes_per_second": round(self.search_nodes / uptime) if uptime else 0,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+            "queue": {"waiting": self.waiting, "max_waiting": self.max_waiting, "running": self.running, "limit": self.queue_limit},
+            "latency_ms": {"mean": round(sum(latencies) / len(latencies), 1) if latencies else None,
+                           "p50": percentile(latencies, 0.5), "p95": percentile(latencies, 0.95), "max": percentile(latencies, 1.0)},
+            "queue_wait_ms": {"mean": round(sum(self.queue_waits_ms) / len(self.queue_waits_ms), 1) if self.queue_waits_ms else None},
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the checkers engine to many games at once over a local socket (line-delimited JSON).")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix", help="listen on this Unix socket path instead of TCP")
+    parser.add_argument("--workers", type=int, default=default_worker_count(), help="number of searches run at the same time")
+    parser.add_argument("--queue-limit", type=int, default=DEFAULT_QUEUE_LIMIT, help="most searches that may wait for a worker")
+    parser.add_argument("--tablebase", help="endgame tablebase file used by the searches")
+    args = parser.parse_args(argv)
+
+    server = EngineServer(args.workers, args.queue_limit, args.tablebase)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
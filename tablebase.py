@@ -0,0 +1,292 @@
+import argparse
+import itertools
+import mmap
+import struct
+import sys
+import time
+from math import comb
+
+from bitboard import Position, BLACK, WHITE, SQUARES
+
+# Endgame tablebase file format (all integers little-endian):
+#   header:    magic b"CKTB", version (u16), max_pieces (u16), number of tables (u32)
+#   directory: one entry per material signature: black men, black kings, white men, white kings (u8 each), data offset (u64), data size (u64)
+#   data:      one byte per position of each table, see the value encoding below
+# A table holds every placement of its pieces with either side to move. Black men are ranked among squares 4-31 and white men among squares 0-27
+# (a man on its promotion row would already be a king), kings among all 32 squares; placements where two pieces share a square are unused.
+MAGIC = b"CKTB"
+VERSION = 1
+HEADER = struct.Struct("<4sHHI")
+DIRECTORY_ENTRY = struct.Struct("<BBBBQQ")
+DEFAULT_MAX_PIECES = 3
+DEFAULT_PATH = "endgame.cktb"
+
+# Value encoding, from the point of view of the side to move: 0 is a draw, 1-127 is a win in that many plies,
+# 128 + n is a loss in n plies (n = 0 when the side to move has no legal move)
+DRAW = 0
+LOSS_BASE = 128
+MAX_DISTANCE = 127
+WIN, LOSS = "win", "loss"
+
+MAN_SQUARES = 28
+BLACK_MAN_OFFSET = 4
+WHITE_MAN_OFFSET = 0
+
+
+def _rank(mask, offset):
+    # Colex rank of a set of squares (shifted down by offset), used to index piece placements
+    rank = 0
+    for i, square in enumerate(_squares(mask)):
+        rank += comb(square - offset, i + 1)
+    return rank
+
+
+def _squares(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def signature(position):
+    # The material signature of a position: (black men, black kings, white men, white kings)
+    return (position.black_men.bit_count(), position.black_kings.bit_count(),
+            position.white_men.bit_count(), position.white_kings.bit_count())
+
+
+def table_size(sig):
+    black_men, black_kings, white_men, white_kings = sig
+    return comb(MAN_SQUARES, black_men) * comb(SQUARES, black_kings) * comb(MAN_SQUARES, white_men) * comb(SQUARES, white_kings) * 2
+
+
+def position_index(position, sig):
+    # Index of a position inside the table of its material signature
+    black_men, black_kings, white_men, white_kings = sig
+    index = _rank(position.black_men, BLACK_MAN_OFFSET)
+    index = index * comb(SQUARES, black_kings) + _rank(position.black_kings, 0)
+    index = index * comb(MAN_SQUARES, white_men) + _rank(position.white_men, WHITE_MAN_OFFSET)
+    index = index * comb(SQUARES, white_kings) + _rank(position.white_kings, 0)
+    return index * 2 + (1 if position.turn == WHITE else 0)
+
+
+def signatures(max_pieces):
+    # All material signatures with at most max_pieces pieces and at least one piece per side.
+    # They are ordered so that every position a move can lead to belongs to an earlier signature or the same one:
+    # captures lower the piece count and promotions turn a man into a king, so fewer pieces come first, then fewer men.
+    result = []
+    for total in range(2, max_pieces + 1):
+        for sig in itertools.product(range(total + 1), repeat=4):
+            black_men, black_kings, white_men, white_kings = sig
+            if sum(sig) == total and black_men + black_kings > 0 and white_men + white_kings > 0:
+                result.append(sig)
+    result.sort(key=lambda sig: (sum(sig), sig[0] + sig[2], sig))
+    return result
+
+
+def _placements(sig):
+    # Yield every position of a signature with black to move, skipping placements where two pieces share a square
+    black_men, black_kings, white_men, white_kings = sig
+    for black_men_squares in itertools.combinations(range(BLACK_MAN_OFFSET, SQUARES), black_men):
+        black_men_mask = sum(1 << square for square in black_men_squares)
+        for black_kings_squares in itertools.combinations(range(SQUARES), black_kings):
+            black_kings_mask = sum(1 << square for square in black_kings_squares)
+            if black_kings_mask & black_men_mask:
+                continue
+            black_mask = black_men_mask | black_kings_mask
+            for white_men_squares in itertools.combinations(range(WHITE_MAN_OFFSET, MAN_SQUARES), white_men):
+                white_men_mask = sum(1 << square for square in white_men_squares)
+                if white_men_mask & black_mask:
+                    continue
+                for white_kings_squares in itertools.combinations(range(SQUARES), white_kings):
+                    white_kings_mask = sum(1 << square for square in white_kings_squares)
+                    if white_kings_mask & (black_mask | white_men_mask):
+                        continue
+                    yield Position(black_men_mask, black_kings_mask, white_men_mask, white_kings_mask, BLACK)
+
+
+def encode(result, distance):
+    if result == WIN:
+        return distance
+    if result == LOSS:
+        return LOSS_BASE + distance
+    return DRAW
+
+
+def decode(value):
+    # Decode a stored byte into (result, distance) from the point of view of the side to move, with result None for a draw
+    if value == DRAW:
+        return None, 0
+    if value >= LOSS_BASE:
+        return LOSS, value - LOSS_BASE
+    return WIN, value
+
+
+def solve_table(sig, tables):
+    # Solve every position of one signature by retrograde analysis, given the solved tables of all the signatures its moves can lead to.
+    # Positions are resolved in order of increasing distance: a position is won when one of its moves leads to a lost position, with the shortest such win,
+    # and lost when all of its moves lead to won positions, with the longest such loss. Whatever is never resolved is a draw.
+    size = table_size(sig)
+    values = bytearray(size)
+    predecessors = {}
+    best_win = {}
+    longest_loss = {}
+    unresolved = {}
+    has_draw = set()
+    buckets = {}
+
+    def push(distance, index, result):
+        if distance > MAX_DISTANCE:
+            raise ValueError("distance %d does not fit in the table format" % distance)
+        buckets.setdefault(distance, []).append((index, result))
+
+    for black_to_move in _placements(sig):
+        for turn in (BLACK, WHITE):
+            position = black_to_move.copy()
+            position.set_turn(turn)
+            index = position_index(position, sig)
+            moves = position.get_legal_moves(turn)
+            if not moves:
+                push(0, index, LOSS)
+                continue
+            inside = []
+            win = None
+            loss = 0
+            draw = False
+            for move in moves:
+                record = position.apply(move)
+                if position.is_game_over():
+                    # The move captured the last opposing piece or left the opponent without a move
+                    win = 1
+                else:
+                    successor_sig = signature(position)
+                    successor_index = position_index(position, successor_sig)
+                    if successor_sig == sig:
+                        inside.append(successor_index)
+                    else:
+                        result, distance = decode(tables[successor_sig][successor_index])
+                        if result == LOSS:
+                            win = distance + 1 if win is None else min(win, distance + 1)
+                        elif result == WIN:
+                            loss = max(loss, distance + 1)
+                        else:
+                            draw = True
+                position.undo(record)
+            for successor_index in inside:
+                predecessors.setdefault(successor_index, []).append(index)
+            unresolved[index] = len(inside)
+            longest_loss[index] = loss
+            if draw:
+                has_draw.add(index)
+            if win is not None:
+                best_win[index] = win
+                push(win, index, WIN)
+            elif not inside and not draw:
+                push(loss, index, LOSS)
+
+    solved = set()
+    distance = 0
+    while buckets:
+        if distance not in buckets:
+            distance += 1
+            continue
+        for index, result in buckets.pop(distance):
+            if index in solved:
+                continue
+            solved.add(index)
+            values[index] = encode(result, distance)
+            for predecessor in predecessors.get(index, ()):
+                if predecessor in solved:
+                    continue
+                if result == LOSS:
+                    push(distance + 1, predecessor, WIN)
+                else:
+                    unresolved[predecessor] -= 1
+                    longest_loss[predecessor] = max(longest_loss[predecessor], distance + 1)
+                    if unresolved[predecessor] == 0 and predecessor not in best_win and predecessor not in has_draw:
+                        push(longest_loss[predecessor], predecessor, LOSS)
+        distance += 1
+    return values
+
+
+def build(max_pieces, path, verbose=False):
+    # Build the tables of every signature with at most max_pieces pieces and write them to a tablebase file
+    tables = {}
+    for sig in signatures(max_pieces):
+        start = time.perf_counter()
+        tables[sig] = solve_table(sig, tables)
+        if verbose:
+            wins = sum(1 for value in tables[sig] if 0 < value < LOSS_BASE)
+            losses = sum(1 for value in tables[sig] if value >= LOSS_BASE)
+            print("%s: %d entries, %d wins, %d losses, %.1fs" % (sig, len(tables[sig]), wins, losses, time.perf_counter() - start))
+    write(tables, max_pieces, path)
+    return tables
+
+
+def write(tables, max_pieces, path):
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, max_pieces, len(tables)))
+        offset = HEADER.size + DIRECTORY_ENTRY.size * len(tables)
+        for sig, values in tables.items():
+            f.write(DIRECTORY_ENTRY.pack(*sig, offset, len(values)))
+            offset += len(values)
+        for values in tables.values():
+            f.write(values)
+
+
+class Tablebase:
+    # The Tablebase class probes a tablebase file written by build.
+    # The file is memory-mapped rather than read, so only the pages of the tables that are actually probed are loaded into memory.
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.max_pieces, count = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a checkers tablebase file" % path)
+        self.tables = {}
+        for i in range(count):
+            black_men, black_kings, white_men, white_kings, offset, size = DIRECTORY_ENTRY.unpack_from(
+                self.data, HEADER.size + i * DIRECTORY_ENTRY.size)
+            self.tables[(black_men, black_kings, white_men, white_kings)] = (offset, size)
+        self.probes = 0
+        self.hits = 0
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def probe(self, position):
+        # Return (result, distance) for the side to move, with result WIN, LOSS or None for a draw,
+        # or None when the position is not covered by the tablebase
+        self.probes += 1
+        sig = signature(position)
+        table = self.tables.get(sig)
+        if table is None:
+            return None
+        self.hits += 1
+        return decode(self.data[table[0] + position_index(position, sig)])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or probe the checkers endgame tablebase.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="generate the tablebase by retrograde analysis")
+    build_parser.add_argument("--pieces", type=int, default=DEFAULT_MAX_PIECES, help="maximum number of pieces on the board")
+    build_parser.add_argument("--output", default=DEFAULT_PATH, help="tablebase file to write")
+    info_parser = subparsers.add_parser("info", help="show the tables in a tablebase file")
+    info_parser.add_argument("path", nargs="?", default=DEFAULT_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        build(args.pieces, args.output, verbose=True)
+    else:
+        tablebase = Tablebase(args.path)
+        print("%s: up to %d pieces, %d tables" % (args.path, tablebase.max_pieces, len(tablebase.tables)))
+        for sig, (offset, size) in tablebase.tables.items():
+            print("  black men %d, black kings %d, white men %d, white kings %d: %d entries" % (sig + (size,)))
+        tablebase.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,15 @@
+import pytest
+
+from arena import DEFAULT_DEPTH, engine_limits
+
+
+def test_engine_limits():
+    assert engine_limits(None, None) == (DEFAULT_DEPTH, None)
+    assert engine_limits(None, 500) == (None, 500)
+    assert engine_limits(0, 500) == (None, 500)
+    assert engine_limits(6, None) == (6, None)
+    assert engine_limits(3, 100) == (3, 100)
+    with pytest.raises(ValueError):
+        engine_limits(0, None)
+    with pytest.raises(ValueError):
+        engine_limits(0, 0)
@@ -0,0 +1,86 @@
+import random
+
+import pytest
+
+from bitboard import (Position, BLACK, WHITE, MOVE_CAPTURED_SHIFT, MOVE_SQUARE_MASK, format_fen, format_move, pack_move, parse_fen, parse_move,
+                      row_col_to_square, square_to_row_col)
+
+
+def play_stepwise(position, move):
+    # Play a capture one jump at a time, the way the user interface shows it (see CheckersGame.get_move_steps)
+    start = move & MOVE_SQUARE_MASK
+    for landing in position.get_capture_path(move):
+        start_row, start_col = square_to_row_col(start)
+        end_row, end_col = square_to_row_col(landing)
+        middle = row_col_to_square((start_row + end_row) // 2, (start_col + end_col) // 2)
+        position.apply(pack_move(start, landing, 1 << middle))
+        start = landing
+
+
+def test_double_jump_played_stepwise_keeps_hash():
+    # A black man on (6, 1) jumps the white men on (5, 2) and (3, 4), landing on (4, 3) and then (2, 5)
+    black_man = 1 << row_col_to_square(6, 1)
+    white_men = (1 << row_col_to_square(5, 2)) | (1 << row_col_to_square(3, 4)) | (1 << row_col_to_square(0, 7))
+    position = Position(black_men=black_man, white_men=white_men, turn=BLACK)
+    (move,) = position.get_legal_moves(BLACK)
+    assert len(position.get_capture_path(move)) == 2
+
+    stepwise = position.copy()
+    play_stepwise(stepwise, move)
+    position.apply(move)
+    assert stepwise.turn == WHITE
+    assert stepwise.hash == stepwise.compute_hash()
+    assert stepwise.hash == position.hash
+    assert (stepwise.counts, stepwise.features) == position.compute_counters()
+
+
+def test_random_games_played_stepwise_keep_hash():
+    rng = random.Random(1)
+    multi_jumps = 0
+    for _ in range(50):
+        position = Position.initial()
+        for _ in range(150):
+            moves = position.get_legal_moves(position.turn)
+            if not moves:
+                break
+            move = rng.choice(moves)
+            if move >> MOVE_CAPTURED_SHIFT and len(position.get_capture_path(move)) > 1:
+                multi_jumps += 1
+                play_stepwise(position, move)
+            else:
+                position.apply(move)
+            assert position.hash == position.compute_hash()
+            assert (position.counts, position.features) == position.compute_counters()
+    assert multi_jumps > 0
+
+
+def test_fen_uses_standard_square_numbers():
+    assert format_fen(Position.initial()) == "B:W21,22,23,24,25,26,27,28,29,30,31,32:B1,2,3,4,5,6,7,8,9,10,11,12"
+    assert parse_fen('[FEN "B:W21-32:B1-12."]').hash == Position.initial().hash
+    with pytest.raises(ValueError):
+        parse_fen("B:W1-12:B21-32")
+
+
+def test_move_notation_uses_standard_square_numbers():
+    position = Position.initial()
+    assert sorted(format_move(position, move) for move in position.get_legal_moves(BLACK)) == [
+        "10-14", "10-15", "11-15", "11-16", "12-16", "9-13", "9-14"]
+    position = parse_fen("B:W14,23,K30:B9")
+    (move,) = position.get_legal_moves(BLACK)
+    assert format_move(position, move) == "9x18x27"
+    assert parse_move(position, "9x27") == move
+
+
+def test_from_board_computes_counters():
+    position = Position.from_board(Position.initial().to_board())
+    assert position.counts == [12, 0, 12, 0]
+    assert (position.counts, position.features) == position.compute_counters()
+    assert position.features == Position.initial().features
+    assert position.hash == Position.initial().hash
+    assert not position.is_game_over()
+
+    position = parse_fen("W:W18,K5:B10,K27")
+    rebuilt = Position.from_board(position.to_board(), WHITE)
+    assert rebuilt.counts == [1, 1, 1, 1]
+    assert (rebuilt.counts, rebuilt.features, rebuilt.hash) == (position.counts, position.features, position.hash)
+    assert not rebuilt.is_game_over()
@@ -0,0 +1,17 @@
+from bitboard import Position
+from book import OpeningBook, main
+
+
+def test_self_play_book_covers_start_position(tmp_path):
+    path = str(tmp_path / "opening.ckbk")
+    assert main(["build", "--self-play", "6", "--depth", "2", "--workers", "1", "--min-games", "1", "--output", path]) == 0
+    book = OpeningBook(path)
+    try:
+        position = Position.initial()
+        entries = book.lookup(position)
+        assert entries
+        # The engine's reply to a book move is in the book as well
+        position.apply(entries[0][0])
+        assert book.lookup(position)
+    finally:
+        book.close()
@@ -0,0 +1,14 @@
+from bitboard import parse_fen
+from search import Searcher
+
+
+def test_forced_move_is_searched_to_full_depth_on_request():
+    # White's only legal move is the double jump 32x23x16
+    position = parse_fen("W:W32:B3,19,27")
+    shortcut = Searcher(position.copy())
+    shortcut.search(6)
+    assert shortcut.stats.depth == 1
+    full = Searcher(position.copy(), search_forced_moves=True)
+    full.search(6)
+    assert full.stats.depth == 6
+    assert len(full.stats.principal_variation) > 1
@@ -0,0 +1,30 @@
+import asyncio
+import json
+
+from server import EngineServer
+
+
+async def request(server, **fields):
+    return await server.handle_line(json.dumps(fields))
+
+
+def test_bad_search_limits_are_rejected_without_holding_a_worker():
+    server = EngineServer(workers=1)
+
+    async def run():
+        server.slots = asyncio.Semaphore(server.workers)
+        assert (await request(server, cmd="new", session="a"))["ok"]
+        assert not (await request(server, cmd="new", session="b", time_ms="x"))["ok"]
+        for fields in ({"timeout_ms": "x"}, {"timeout_ms": None}, {"time_ms": "x"}, {"depth": 0}, {"depth": 2.5}):
+            response = await request(server, cmd="go", session="a", **fields)
+            assert not response["ok"] and "internal error" not in response["error"]
+            assert not server.slots.locked()
+        response = await request(server, cmd="go", session="a", depth=2, time_ms=None, timeout_ms=10000)
+        assert response["ok"] and response["move"]
+        await asyncio.sleep(0)
+        assert not server.slots.locked()
+
+    try:
+        asyncio.run(run())
+    finally:
+        server.close()
@@ -0,0 +1,88 @@
+import cProfile
+import io
+import json
+import pstats
+import threading
+import time
+
+from bitboard import format_move
+
+# Number of functions, by cumulative time, included in each traced search's profile summary
+PROFILE_TOP_FUNCTIONS = 15
+
+
+class SearchTracer:
+    # The SearchTracer class runs searches on behalf of the caller and appends one JSON line per search to a trace file:
+    # the position, the move chosen in square notation, the principal variation and every counter of the search's SearchStats.
+    # With profile=True each search also runs under cProfile; the trace line then gets the functions that took the most time,
+    # and the profiles of all the searches are added up so they can be saved with dump_profile and read with pstats or snakeviz.
+
+    def __init__(self, path, profile=False):
+        self.path = path
+        self.profile = profile
+        self.profile_stats = None
+        self.searches = 0
+        self.lock = threading.Lock()
+
+    def run(self, searcher, max_depth, time_ms=None):
+        # Run searcher.search(max_depth, time_ms), write its trace line and return its (score, best_move)
+        position = searcher.position.copy()
+        if self.profile:
+            profiler = cProfile.Profile()
+            result = profiler.runcall(searcher.search, max_depth, time_ms)
+        else:
+            profiler = None
+            result = searcher.search(max_depth, time_ms)
+        self.write(position, searcher.stats, profiler)
+        return result
+
+    def write(self, position, stats, profiler=None):
+        # Append the trace line of a finished search of the given position
+        record = {
+            "time": round(time.time(), 3),
+            "turn": position.turn,
+            "position": [position.black_men, position.black_kings, position.white_men, position.white_kings],
+            "move": format_move(position, stats.best_move) if stats.best_move is not None else None,
+            "principal_variation": self.format_line(position, stats.principal_variation),
+            "stats": stats.as_dict(),
+        }
+        with self.lock:
+            if profiler is not None:
+                record["profile"] = self.summarize_profile(profiler)
+                if self.profile_stats is None:
+                    self.profile_stats = pstats.Stats(profiler)
+                else:
+                    self.profile_stats.add(profiler)
+            record["search"] = self.searches
+            self.searches += 1
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+
+    @staticmethod
+    def format_line(position, moves):
+        # Write a line of moves from a position in square notation
+        position = position.copy()
+        line = []
+        for move in moves:
+            line.append(format_move(position, move))
+            position.apply(move)
+        return line
+
+    @staticmethod
+    def summarize_profile(profiler):
+        # Return the functions of a profile that took the most cumulative time, as a list of dicts
+        stats = pstats.Stats(profiler, stream=io.StringIO())
+        stats.sort_stats("cumulative")
+        summary = []
+        for function in stats.fcn_list[:PROFILE_TOP_FUNCTIONS]:
+            primitive_calls, calls, own_time, cumulative_time, _ = stats.stats[function]
+            filename, line, name = function
+            summary.append({"function": "%s:%d(%s)" % (filename, line, name), "calls": calls,
+                            "own_ms": round(own_time * 1000.0, 1), "cumulative_ms": round(cumulative_time * 1000.0, 1)})
+        return summary
+
+    def dump_profile(self, path):
+        # Save the combined profile of all the traced searches in the pstats format
+        with self.lock:
+            if self.profile_stats is not None:
+                self.profile_stats.dump_stats(path)
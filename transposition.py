@@ -0,0 +1,64 @@
+# Bound types stored with each transposition table score
+EXACT = 0
+LOWER_BOUND = 1
+UPPER_BOUND = 2
+
+# Approximate memory used by one stored entry (the entry tuple, its key and score objects and the table slot), used to turn a size in MB into a number of slots
+ENTRY_BYTES = 200
+DEFAULT_SIZE_MB = 64
+
+
+class TranspositionTable:
+    # The TranspositionTable class remembers the results of earlier searches, keyed by the Zobrist hash of the position.
+    # Each entry stores the hash, the search depth, the score, the bound type of the score, the best move found and the search generation that wrote it.
+    # The table has a fixed number of slots, a power of two derived from the size in MB, and the slot of a position is given by the low bits of its hash.
+    # When two positions compete for a slot, the entry from the deeper search is kept (depth-preferred replacement), unless the stored entry is left over from an earlier search.
+
+    def __init__(self, size_mb=DEFAULT_SIZE_MB):
+        slots = max(1, int(size_mb * 1024 * 1024) // ENTRY_BYTES)
+        self.size = 1 << (slots.bit_length() - 1)
+        self.mask = self.size - 1
+        self.entries = [None] * self.size
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+
+    def new_search(self):
+        # Start a new search generation. Entries from older generations can always be replaced.
+        self.generation += 1
+
+    def clear(self):
+        self.entries = [None] * self.size
+        self.generation = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+
+    def probe(self, key):
+        # Return the stored entry (key, depth, score, bound, best_move, generation) for a position, or None when the position is not in the table
+        self.probes += 1
+        entry = self.entries[key & self.mask]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        return None
+
+    def store(self, key, depth, score, bound, best_move):
+        # Store a search result, keeping the existing entry if it comes from a deeper search of the current generation
+        index = key & self.mask
+        entry = self.entries[index]
+        if entry is None or entry[0] == key or entry[5] != self.generation or depth >= entry[1]:
+            self.entries[index] = (key, depth, score, bound, best_move, self.generation)
+            self.stores += 1
+
+    def hit_rate(self):
+        # Fraction of probes that found their position in the table
+        return self.hits / self.probes if self.probes else 0.0
+
+    def usage(self):
+        # Fraction of the slots that hold an entry
+        return sum(1 for entry in self.entries if entry is not None) / self.size
@@ -0,0 +1,148 @@
+import argparse
+import json
+import sys
+import time
+
+from bitboard import Position, BLACK, WHITE, FEATURE_NAMES, FEATURE_SCALE, EVALUATION_WEIGHTS, EVALUATION_WEIGHTS_FILE, parse_move
+from evaluation import np, feature_matrix, weight_vector
+
+# Texel tuning of the evaluation weights: the evaluation of a position, passed through a logistic function, should predict the result of the game it was played in.
+# The positions are the quiet positions (no capture available) of recorded games, labelled with the game's result for white: 1, 0.5 or 0.
+# Fitting P(white wins) = 1 / (1 + exp(-features . beta)) to the results is a logistic regression on the feature values, solved with Newton's method
+# over the whole set of positions at once. The fitted beta is then rescaled so that a man is worth FEATURE_SCALE, which gives weights in the units of bitboard.py;
+# the scale factor itself is the steepness of the curve that maps evaluations to expected results.
+DEFAULT_SKIP_PLIES = 8
+DEFAULT_ITERATIONS = 25
+# L2 regularization strength, which keeps the fit stable when a feature barely varies in the data
+DEFAULT_L2 = 1e-6
+# Positions are turned into feature rows this many at a time, so that only the feature matrix, not the positions, is kept in memory
+CHUNK_SIZE = 100000
+RESULT_SCORES = {WHITE: 1.0, BLACK: 0.0, "draw": 0.5}
+
+
+def game_positions(records, skip_plies=DEFAULT_SKIP_PLIES):
+    # Yield (black men, black kings, white men, white kings, white to move) and white's result for the quiet positions of game records
+    # (in the JSONL format written by arena.py), leaving out the first skip_plies plies of each game
+    for record in records:
+        result = RESULT_SCORES[record["result"]]
+        position = Position.initial()
+        for ply, text in enumerate(record["opening"] + record["moves"]):
+            if ply >= skip_plies and not position.get_jumpers(position.turn):
+                yield (position.black_men, position.black_kings, position.white_men, position.white_kings, position.turn == WHITE), result
+            position.apply(parse_move(position, text))
+
+
+def load_samples(paths, skip_plies=DEFAULT_SKIP_PLIES, max_positions=None):
+    # Read the game records of the files and return the feature matrix of their quiet positions and the results
+    feature_chunks = []
+    result_chunks = []
+    states = []
+    results = []
+    count = 0
+
+    def flush():
+        if states:
+            feature_chunks.append(feature_matrix(np.array(states, dtype=np.int64)))
+            result_chunks.append(np.array(results, dtype=np.float64))
+            del states[:], results[:]
+
+    for path in paths:
+        with open(path) as f:
+            records = (json.loads(line) for line in f if line.strip())
+            for state, result in game_positions(records, skip_plies):
+                states.append(state)
+                results.append(result)
+                count += 1
+                if len(states) == CHUNK_SIZE:
+                    flush()
+                if max_positions is not None and count >= max_positions:
+                    break
+        if max_positions is not None and count >= max_positions:
+            break
+    flush()
+    if not feature_chunks:
+        return np.zeros((0, len(FEATURE_NAMES))), np.zeros(0)
+    return np.concatenate(feature_chunks), np.concatenate(result_chunks)
+
+
+def sigmoid(x):
+    return 0.5 * (1.0 + np.tanh(0.5 * x))
+
+
+def log_loss(features, results, beta):
+    # Mean cross-entropy between the predicted and the actual results
+    predicted = np.clip(sigmoid(features @ beta), 1e-12, 1.0 - 1e-12)
+    return float(-np.mean(results * np.log(predicted) + (1.0 - results) * np.log(1.0 - predicted)))
+
+
+def fit(features, results, iterations=DEFAULT_ITERATIONS, l2=DEFAULT_L2):
+    # Fit the logistic regression of the results on the features by Newton's method and return beta
+    count, size = features.shape
+    beta = np.zeros(size)
+    for _ in range(iterations):
+        predicted = sigmoid(features @ beta)
+        gradient = features.T @ (predicted - results) / count + l2 * beta
+        curvature = predicted * (1.0 - predicted)
+        hessian = (features * curvature[:, None]).T @ features / count + l2 * np.eye(size)
+        step = np.linalg.solve(hessian, gradient)
+        beta -= step
+        if np.max(np.abs(step)) < 1e-9:
+            break
+    return beta
+
+
+def tune(features, results, iterations=DEFAULT_ITERATIONS, l2=DEFAULT_L2):
+    # Fit the weights to the samples and return a summary: the new weights, the scale of the logistic curve and the loss of the current and of the new weights
+    current = weight_vector()
+    # The current weights only get their best scale fitted, for a fair comparison
+    current_scale = fit((features @ current)[:, None], results, iterations, l2)[0]
+    beta = fit(features, results, iterations, l2)
+    man = FEATURE_NAMES.index("man")
+    if beta[man] <= 0:
+        raise ValueError("the results do not show an advantage for the side with more men; more games are needed")
+    scale = beta[man] / FEATURE_SCALE
+    weights = {name: int(round(value / scale)) for name, value in zip(FEATURE_NAMES, beta)}
+    return {
+        "weights": weights,
+        "scale": float(scale),
+        "positions": int(len(results)),
+        "loss": log_loss(features, results, weight_vector(weights) * scale),
+        "previous_weights": dict(EVALUATION_WEIGHTS),
+        "previous_loss": log_loss(features, results, current * current_scale),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fit the evaluation weights to the results of recorded games (Texel tuning).")
+    parser.add_argument("games", nargs="+", help="JSONL game records written by arena.py")
+    parser.add_argument("--skip-plies", type=int, default=DEFAULT_SKIP_PLIES, help="leave out this many plies at the start of every game")
+    parser.add_argument("--max-positions", type=int, help="stop reading after this many positions")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS, help="most Newton iterations of the fit")
+    parser.add_argument("--l2", type=float, default=DEFAULT_L2, help="L2 regularization strength")
+    parser.add_argument("--output", default=EVALUATION_WEIGHTS_FILE, help="JSON file to write the weights to")
+    args = parser.parse_args(argv)
+    if np is None:
+        parser.error("the tuner needs NumPy (pip install numpy)")
+
+    start = time.perf_counter()
+    features, results = load_samples(args.games, args.skip_plies, args.max_positions)
+    if not len(results):
+        parser.error("the game records hold no quiet positions")
+    loaded = time.perf_counter()
+    try:
+        summary = tune(features, results, args.iterations, args.l2)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 1
+    with open(args.output, "w") as f:
+        json.dump(summary, f, indent=2)
+    print("%d positions read in %.1fs, fitted in %.1fs" % (summary["positions"], loaded - start, time.perf_counter() - loaded))
+    print("loss %.5f -> %.5f" % (summary["previous_loss"], summary["loss"]))
+    for name in FEATURE_NAMES:
+        print("  %-12s %5d -> %5d" % (name, summary["previous_weights"][name], summary["weights"][name]))
+    print("weights written to %s" % args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())